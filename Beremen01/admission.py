@@ -0,0 +1,176 @@
+import heapq
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import jsonify
+
+import request_stats
+
+DB_PATH = "pregnancy.db"
+# Одновременно работающих с БД запросов и сколько ещё может ждать в очереди
+MAX_ACTIVE = int(os.environ.get("DB_MAX_ACTIVE", 4))
+MAX_QUEUE = int(os.environ.get("DB_MAX_QUEUE", 16))
+# Сколько запрос ждёт места в очереди и сколько SQLite ждёт блокировку
+MAX_WAIT = float(os.environ.get("DB_MAX_WAIT", 2.0))
+LOCK_TIMEOUT = float(os.environ.get("DB_LOCK_TIMEOUT", 2.0))
+RETRY_AFTER = int(os.environ.get("DB_RETRY_AFTER", 1))
+
+# Меньше — раньше: чтения обслуживаются первыми, пакетные задания последними
+PRIORITY = {"read": 0, "write": 1, "batch": 2}
+# Пакетные задания не отбрасываются, а ждут своей очереди
+SHEDDABLE = ("read", "write")
+
+WAIT_WINDOW = 2000
+
+
+class Overloaded(Exception):
+    def __init__(self, reason, retry_after=RETRY_AFTER):
+        super().__init__(f"overloaded: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def overloaded_response(error):
+    response = jsonify({"error": "Сервер перегружен, повторите позже", "reason": error.reason})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+def is_lock_error(error):
+    return isinstance(error, sqlite3.OperationalError) and (
+        "database is locked" in str(error) or "database is busy" in str(error)
+    )
+
+
+def raise_if_locked(error):
+    """В общих except: блокировку БД отдаём как 503, а не как 500"""
+    if is_lock_error(error):
+        _count_shed(None, "lock_timeout")
+        raise Overloaded("lock_timeout") from error
+
+
+def connect(db_path=DB_PATH):
+    """Соединение с ограниченным ожиданием блокировки"""
+    return sqlite3.connect(db_path, timeout=LOCK_TIMEOUT)
+
+
+# RLock внутри: _count_shed можно вызывать и под уже взятой блокировкой
+_cond = threading.Condition(threading.RLock())
+_active = 0
+_waiting = []
+_seq = itertools.count()
+_stats = {
+    "admitted": {kind: 0 for kind in PRIORITY},
+    "shed": {},
+    "max_queue_depth": 0,
+}
+_waits_ms = deque(maxlen=WAIT_WINDOW)
+
+
+def _count_shed(kind, reason):
+    with _cond:
+        key = f"{kind}:{reason}" if kind else reason
+        _stats["shed"][key] = _stats["shed"].get(key, 0) + 1
+
+
+def acquire(kind, timeout=MAX_WAIT):
+    """Занимает место для работы с БД; timeout=None — ждать без ограничения"""
+    global _active
+    started = time.perf_counter()
+    with _cond:
+        if _active < MAX_ACTIVE and not _waiting:
+            _active += 1
+            _stats["admitted"][kind] += 1
+            _waits_ms.append(0.0)
+            return
+        # Ждущие пакетные задания в лимит очереди не входят
+        queued = sum(1 for priority, _ in _waiting if priority < PRIORITY["batch"])
+        if kind in SHEDDABLE and queued >= MAX_QUEUE:
+            _count_shed(kind, "queue_full")
+            raise Overloaded("queue_full")
+
+        ticket = (PRIORITY[kind], next(_seq))
+        heapq.heappush(_waiting, ticket)
+        _stats["max_queue_depth"] = max(_stats["max_queue_depth"], len(_waiting))
+        deadline = None if timeout is None else started + timeout
+        while True:
+            if _waiting[0] == ticket and _active < MAX_ACTIVE:
+                heapq.heappop(_waiting)
+                _active += 1
+                _stats["admitted"][kind] += 1
+                _waits_ms.append((time.perf_counter() - started) * 1000)
+                # Следующий в очереди тоже может пройти, если мест несколько
+                _cond.notify_all()
+                return
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if remaining is not None and remaining <= 0:
+                _waiting.remove(ticket)
+                heapq.heapify(_waiting)
+                _cond.notify_all()
+                _count_shed(kind, "wait_timeout")
+                raise Overloaded("wait_timeout")
+            _cond.wait(remaining)
+
+
+def release():
+    global _active
+    with _cond:
+        _active -= 1
+        _cond.notify_all()
+
+
+@contextmanager
+def slot(kind, timeout=MAX_WAIT):
+    acquire(kind, timeout)
+    try:
+        yield
+    finally:
+        release()
+
+
+def limit(kind):
+    """Декоратор маршрута: допуск к БД по классу read/write"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with slot(kind):
+                try:
+                    return view(*args, **kwargs)
+                except sqlite3.OperationalError as e:
+                    raise_if_locked(e)
+                    raise
+        return wrapper
+    return decorator
+
+
+def report():
+    """Глубина очереди, отказы и ожидание — для /admin/admission"""
+    with _cond:
+        waits = sorted(_waits_ms)
+        queued = {kind: 0 for kind in PRIORITY}
+        for priority, _ in _waiting:
+            for kind, value in PRIORITY.items():
+                if value == priority:
+                    queued[kind] += 1
+        return {
+            "active": _active,
+            "queued": queued,
+            "max_queue_depth": _stats["max_queue_depth"],
+            "admitted": dict(_stats["admitted"]),
+            "shed": dict(_stats["shed"]),
+            "wait_p50_ms": request_stats._percentile(waits, 50),
+            "wait_p99_ms": request_stats._percentile(waits, 99),
+            "limits": {
+                "max_active": MAX_ACTIVE,
+                "max_queue": MAX_QUEUE,
+                "max_wait_s": MAX_WAIT,
+                "lock_timeout_s": LOCK_TIMEOUT,
+            },
+        }
@@ -0,0 +1,221 @@
+"""ASGI-режим: uvicorn asgi:app --workers 1
+
+/health, /webhook и поток /events обслуживаются прямо в цикле событий, остальные маршруты — это
+обычное Flask-приложение, которое выполняется в ограниченном пуле потоков
+async_runtime. Пока поток ждёт SQLite, цикл продолжает принимать запросы.
+"""
+import asyncio
+import io
+import json
+import sys
+import time
+from urllib.parse import parse_qs
+
+import admission
+import async_runtime
+import backup
+import batch_jobs
+import live_events
+import main
+
+flask_app = main.app
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _send_json(send, payload, status=200, headers=()):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                    *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _header(scope, wanted):
+    for name, value in scope["headers"]:
+        if name == wanted:
+            return value.decode("latin-1")
+    return None
+
+
+def _host(scope):
+    host = _header(scope, b"host")
+    if host:
+        return host
+    server = scope.get("server") or ("localhost", 80)
+    return f"{server[0]}:{server[1]}"
+
+
+async def health(scope, receive, send):
+    await _send_json(send, {"status": "ok", "message": "ASGI app is running"})
+
+
+async def webhook(scope, receive, send):
+    """Тот же обработчик, что и во Flask, но без потока на время запроса"""
+    try:
+        data = json.loads(await _read_body(receive) or b"null")
+        if data:
+            payload = main.start_reply(data, _host(scope))
+            if payload:
+                async_runtime.post_nowait(async_runtime.telegram_url("sendMessage"), json=payload)
+        await _send_json(send, {"status": "ok"})
+    except Exception as e:
+        print(f"Ошибка в webhook: {e}")
+        await _send_json(send, {"status": "error"}, 500)
+
+
+async def events(scope, receive, send):
+    """Поток SSE без потока из пула: ожидание событий — asyncio.Event в цикле"""
+    user_id = parse_qs(scope["query_string"].decode("latin-1")).get("user_id", [None])[0]
+    is_valid, error_msg = main.validate_user_id(user_id)
+    if not is_valid:
+        await _send_json(send, {"error": error_msg}, 400)
+        return
+
+    loop = asyncio.get_running_loop()
+    woken = asyncio.Event()
+    try:
+        subscription = live_events.subscribe(user_id, _header(scope, b"last-event-id"),
+                                             notify=lambda: loop.call_soon_threadsafe(woken.set))
+    except admission.Overloaded as error:
+        await _send_json(send, {"error": "Сервер перегружен, повторите позже", "reason": error.reason},
+                         503, [(b"retry-after", str(error.retry_after).encode())])
+        return
+
+    async def body(text):
+        await send({"type": "http.response.body", "body": text.encode("utf-8"), "more_body": True})
+
+    # Тело GET пустое; следующее сообщение от сервера — http.disconnect
+    await _read_body(receive)
+    disconnected = asyncio.ensure_future(receive())
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                        (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")],
+        })
+        await body(f"retry: {live_events.RECONNECT_MS}\n\n")
+        deadline = time.monotonic() + live_events.MAX_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            woken.clear()
+            chunk = subscription.poll()
+            if chunk:
+                await body(chunk)
+            timeout = min(live_events.HEARTBEAT, deadline - time.monotonic())
+            waiter = asyncio.ensure_future(woken.wait())
+            done, _ = await asyncio.wait({disconnected, waiter}, timeout=max(timeout, 0),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            if disconnected in done:
+                return
+            if not done:
+                await body(": ping\n\n")
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        subscription.close()
+        disconnected.cancel()
+
+
+NATIVE_ROUTES = {
+    ("GET", "/health"): health,
+    ("POST", "/webhook"): webhook,
+    ("GET", "/events"): events,
+}
+
+
+def _environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        # Тело уже прочитано целиком — его длина известна и без заголовка
+        "CONTENT_LENGTH": str(len(body)),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_LENGTH":
+            continue
+        if name == "CONTENT_TYPE":
+            environ[name] = value
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def call_flask(scope, receive, send):
+    """Запускает Flask в пуле async_runtime и отдаёт тело по частям"""
+    body = await _read_body(receive)
+    environ = _environ(scope, body)
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+    def begin():
+        result = flask_app(environ, start_response)
+        return result, iter(result)
+
+    end = object()
+    result, chunks = await async_runtime.run_db(begin)
+    try:
+        chunk = await async_runtime.run_db(next, chunks, end)
+        await send({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+        while chunk is not end:
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            chunk = await async_runtime.run_db(next, chunks, end)
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(result, "close"):
+            await async_runtime.run_db(result.close)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            batch_jobs.start_scheduler()
+            backup.start_scheduler()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            async_runtime.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    handler = NATIVE_ROUTES.get((scope["method"], scope["path"]), call_flask)
+    await handler(scope, receive, send)
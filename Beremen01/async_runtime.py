@@ -0,0 +1,133 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+    import requests
+
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
+# Потоки для синхронной работы (SQLite, Flask в ASGI-режиме) — ограниченный пул
+DB_THREADS = int(os.environ.get("ASYNC_DB_THREADS", 8))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 20))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 10))
+
+_lock = threading.Lock()
+_loop = None
+_client = None
+_db_pool = None
+# Без httpx запросы идут через requests.Session в отдельных потоках
+_http_pool = None
+_session = None
+
+
+def telegram_url(method, token=None):
+    token = token or os.environ.get("TELEGRAM_BOT_TOKEN")
+    return f"{TELEGRAM_API_URL}/bot{token}/{method}"
+
+
+def get_loop():
+    """Фоновый цикл событий для исходящих запросов из синхронного кода"""
+    global _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="async-runtime", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def db_pool():
+    global _db_pool
+    with _lock:
+        if _db_pool is None:
+            _db_pool = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+        return _db_pool
+
+
+async def run_db(fn, *args):
+    """Выполняет блокирующую функцию (SQLite) в пуле, не занимая цикл событий"""
+    return await asyncio.get_running_loop().run_in_executor(db_pool(), fn, *args)
+
+
+def _get_client():
+    # Клиент httpx привязан к циклу, поэтому живёт только в фоновом цикле
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=HTTP_MAX_CONNECTIONS)
+        )
+    return _client
+
+
+def _blocking_post(url, json=None, data=None):
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=HTTP_MAX_CONNECTIONS)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    response = _session.post(url, json=json, data=data, timeout=HTTP_TIMEOUT)
+    return response.status_code, response.json()
+
+
+async def _post(url, json=None, data=None):
+    global _http_pool
+    if httpx is not None:
+        response = await _get_client().post(url, json=json, data=data)
+        return response.status_code, response.json()
+    if _http_pool is None:
+        _http_pool = ThreadPoolExecutor(max_workers=HTTP_MAX_CONNECTIONS, thread_name_prefix="http")
+    return await asyncio.get_running_loop().run_in_executor(_http_pool, _blocking_post, url, json, data)
+
+
+def _log_failure(future):
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        print(f"❌ Ошибка исходящего запроса: {error}")
+    else:
+        status, body = future.result()
+        if status >= 400:
+            print(f"❌ Исходящий запрос вернул {status}: {body}")
+
+
+def post_nowait(url, json=None, data=None):
+    """POST в фоне: обработчик сразу возвращает ответ, ошибки только логируются"""
+    future = asyncio.run_coroutine_threadsafe(_post(url, json=json, data=data), get_loop())
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def post_sync(url, json=None, data=None):
+    """POST с ожиданием ответа, через тот же пул соединений; возвращает JSON"""
+    future = asyncio.run_coroutine_threadsafe(_post(url, json=json, data=data), get_loop())
+    return future.result(timeout=HTTP_TIMEOUT + 1)[1]
+
+
+async def _drain():
+    # Дожидаемся уже запущенных отправок, чтобы не потерять сообщения
+    pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    if pending:
+        await asyncio.wait(pending, timeout=HTTP_TIMEOUT)
+    if _client is not None:
+        await _client.aclose()
+
+
+def shutdown():
+    global _loop, _client, _db_pool
+    with _lock:
+        loop, _loop = _loop, None
+        pool, _db_pool = _db_pool, None
+    if loop is not None:
+        asyncio.run_coroutine_threadsafe(_drain(), loop).result(timeout=HTTP_TIMEOUT + 1)
+        _client = None
+        loop.call_soon_threadsafe(loop.stop)
+    if pool is not None:
+        pool.shutdown(wait=False)
@@ -0,0 +1,259 @@
+import glob
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import admission
+
+DB_PATH = "pregnancy.db"
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "backups")
+# Страниц за шаг и пауза между шагами: блокировка держится только на время шага
+BACKUP_PAGES_PER_STEP = int(os.environ.get("BACKUP_PAGES_PER_STEP", 64))
+BACKUP_STEP_SLEEP = float(os.environ.get("BACKUP_STEP_SLEEP", 0.05))
+BACKUP_KEEP = int(os.environ.get("BACKUP_KEEP", 7))
+BACKUP_INTERVAL_HOURS = float(os.environ.get("BACKUP_INTERVAL_HOURS", 24))
+# Без WAL запись из другого соединения перезапускает копирование с начала
+MAX_RESTARTS = 3
+
+_running = threading.Event()
+_lock = threading.Lock()
+last_backup = {}
+
+
+def is_running():
+    return _running.is_set()
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _integrity_check(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    finally:
+        conn.close()
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _copy(db_path, snapshot_path, pages, sleep):
+    """Копирует базу шагами по `pages` страниц с паузой `sleep` между шагами.
+
+    В режиме WAL источник держит одну читающую транзакцию: все шаги видят один
+    снимок, а писатели продолжают работать. Без WAL после MAX_RESTARTS
+    перезапусков база копируется одним шагом.
+    """
+    stats = {"steps": 0, "pages": 0, "restarts": 0, "remaining": None}
+
+    def progress(status, remaining, total):
+        stats["steps"] += 1
+        stats["pages"] = total
+        if stats["remaining"] is not None and remaining > stats["remaining"]:
+            stats["restarts"] += 1
+            if stats["restarts"] >= MAX_RESTARTS:
+                raise _TooManyRestarts()
+        stats["remaining"] = remaining
+        if remaining:
+            # Шаг сделан — пока спим, место у БД свободно для запросов
+            admission.release()
+            time.sleep(sleep)
+            admission.acquire("batch", timeout=None)
+
+    source = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    target = sqlite3.connect(snapshot_path)
+    try:
+        wal = source.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        if wal:
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        admission.acquire("batch", timeout=None)
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except _TooManyRestarts:
+            print("⚠️ Копирование перезапускалось из-за записей, копируем одним шагом")
+            source.backup(target, pages=-1)
+        finally:
+            admission.release()
+        if wal:
+            source.execute("COMMIT")
+    finally:
+        target.close()
+        source.close()
+    stats["wal"] = wal
+    return stats
+
+
+def create_backup(db_path=DB_PATH, backup_dir=BACKUP_DIR,
+                  pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP, keep=BACKUP_KEEP):
+    """Онлайн-копия через sqlite3 backup API, проверка, gzip и ротация"""
+    if not _lock.acquire(blocking=False):
+        print("⚠️ Резервное копирование уже выполняется")
+        return None
+    _running.set()
+    try:
+        os.makedirs(backup_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        final_path = os.path.join(backup_dir, f"pregnancy-{stamp}.db.gz")
+        started = time.perf_counter()
+
+        with tempfile.TemporaryDirectory(dir=backup_dir) as tmp:
+            snapshot_path = os.path.join(tmp, "snapshot.db")
+            stats = _copy(db_path, snapshot_path, pages, sleep)
+            copy_ms = (time.perf_counter() - started) * 1000
+
+            if not _integrity_check(snapshot_path):
+                raise RuntimeError("Снимок не прошёл PRAGMA integrity_check")
+
+            with open(snapshot_path, "rb") as src, gzip.open(final_path + ".tmp", "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+            os.replace(final_path + ".tmp", final_path)
+
+        checksum = _sha256(final_path)
+        with open(final_path + ".sha256", "w") as f:
+            f.write(f"{checksum}  {os.path.basename(final_path)}\n")
+
+        removed = apply_retention(backup_dir, keep)
+        result = {
+            "path": final_path,
+            "size_bytes": os.path.getsize(final_path),
+            "pages": stats["pages"],
+            "steps": stats["steps"],
+            "restarts": stats["restarts"],
+            "wal": stats["wal"],
+            "copy_ms": round(copy_ms, 1),
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+            "removed": removed,
+        }
+        last_backup.clear()
+        last_backup.update(result)
+        print(f"💾 Резервная копия {final_path}: {result['pages']} страниц, {result['steps']} шагов, {result['total_ms']:.0f} мс")
+        return result
+    finally:
+        _running.clear()
+        _lock.release()
+
+
+def list_backups(backup_dir=BACKUP_DIR):
+    """Копии от новых к старым"""
+    return sorted(glob.glob(os.path.join(backup_dir, "pregnancy-*.db.gz")), reverse=True)
+
+
+def apply_retention(backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    removed = []
+    for path in list_backups(backup_dir)[keep:]:
+        for stale in (path, path + ".sha256"):
+            if os.path.exists(stale):
+                os.remove(stale)
+        removed.append(os.path.basename(path))
+    return removed
+
+
+def verify_backup(path):
+    """Проверяет контрольную сумму и целостность сжатого снимка"""
+    checksum_path = path + ".sha256"
+    if os.path.exists(checksum_path):
+        with open(checksum_path) as f:
+            expected = f.read().split()[0]
+        if _sha256(path) != expected:
+            return False
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = os.path.join(tmp, "snapshot.db")
+        with gzip.open(path, "rb") as src, open(snapshot_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        return _integrity_check(snapshot_path)
+
+
+def restore_backup(path, db_path=DB_PATH):
+    """Восстанавливает базу из снимка тем же backup API — без подмены файла под работающим приложением.
+
+    Копирование идёт одним шагом, чтобы другие соединения не увидели базу наполовину восстановленной.
+    """
+    if not verify_backup(path):
+        raise RuntimeError(f"Снимок {path} повреждён")
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = os.path.join(tmp, "snapshot.db")
+        with gzip.open(path, "rb") as src, open(snapshot_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        source = sqlite3.connect(snapshot_path)
+        target = sqlite3.connect(db_path, timeout=30)
+        try:
+            source.backup(target, pages=-1)
+        finally:
+            target.close()
+            source.close()
+    print(f"♻️ База {db_path} восстановлена из {path}")
+
+
+def _seconds_until_due(backup_dir, interval_seconds):
+    """Сколько ждать до следующей копии, считая от самой свежей на диске; 0 — пора сейчас"""
+    backups = list_backups(backup_dir)
+    if not backups:
+        return 0
+    try:
+        newest = max(os.path.getmtime(path) for path in backups)
+    except OSError:
+        return 0
+    return max(0.0, newest + interval_seconds - time.time())
+
+
+def start_scheduler(db_path=DB_PATH, interval_hours=BACKUP_INTERVAL_HOURS, backup_dir=BACKUP_DIR):
+    """Фоновое резервное копирование каждые interval_hours часов.
+
+    Отсчёт ведётся от самой свежей копии на диске, а не от запуска процесса: машина,
+    которая перезапускается чаще интервала (auto_stop на Fly), иначе не сделала бы
+    ни одной копии. Если копия просрочена, она делается сразу после старта.
+    """
+    if interval_hours <= 0:
+        return None
+    interval_seconds = interval_hours * 3600
+
+    def loop():
+        while True:
+            delay = _seconds_until_due(backup_dir, interval_seconds)
+            if delay > 0:
+                print(f"💾 Следующая резервная копия через {delay / 3600:.1f} ч")
+                time.sleep(delay)
+            try:
+                if create_backup(db_path, backup_dir) is None:
+                    # Копию уже делает кто-то другой (например, /admin/backup) — проверим позже
+                    time.sleep(60)
+            except Exception as e:
+                print(f"❌ Ошибка резервного копирования: {e}")
+                # Не повторяем неудачную копию в цикле без паузы
+                time.sleep(interval_seconds)
+
+    thread = threading.Thread(target=loop, name="backup", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "backup"
+
+    if command == "backup":
+        print(create_backup())
+    elif command == "list":
+        for path in list_backups():
+            print(path, os.path.getsize(path))
+    elif command == "verify" and len(sys.argv) > 2:
+        print("✅ Снимок в порядке" if verify_backup(sys.argv[2]) else "❌ Снимок повреждён")
+    elif command == "restore" and len(sys.argv) > 2:
+        restore_backup(sys.argv[2])
+    else:
+        print("Использование: python backup.py [backup | list | verify <файл> | restore <файл>]")
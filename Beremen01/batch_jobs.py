@@ -0,0 +1,282 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import admission
+import cohorts
+from pregnancy_norms import calculate_weight_norm
+
+CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", 500))
+RUN_AT = os.environ.get("BATCH_RUN_AT", "03:00")
+# Запуск, который не обновлял heartbeat дольше этого, считается упавшим
+STALE_AFTER = timedelta(minutes=10)
+
+# Checkpoint задания без разбиения на чанки после его выполнения
+WHOLE_RUN = "*"
+
+# Задания выполняются по порядку: weight_summary читает свежие pregnancy_weeks
+JOBS = []
+
+
+def batch_job(name, driver_table="pregnancy_start"):
+    """Регистрирует задание: функция обрабатывает пользователей (lower, upper].
+
+    Без driver_table задание выполняется целиком одним чанком.
+    """
+    def register(fn):
+        JOBS.append({"name": name, "driver_table": driver_table, "fn": fn})
+        return fn
+    return register
+
+
+def _ensure_column(cursor, table, column, decl):
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def init_batch_tables(cursor):
+    """Журнал запусков и колонки для предвычисленных полей"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS batch_runs (
+            job TEXT,
+            run_date TEXT,
+            status TEXT,
+            checkpoint TEXT,
+            rows INTEGER DEFAULT 0,
+            chunks INTEGER DEFAULT 0,
+            started_at TEXT,
+            heartbeat_at TEXT,
+            finished_at TEXT,
+            duration_ms REAL DEFAULT 0,
+            PRIMARY KEY (job, run_date)
+        )
+    """)
+    _ensure_column(cursor, "pregnancy_weeks", "trimester", "INTEGER")
+    _ensure_column(cursor, "pregnancy_weeks", "computed_on", "TEXT")
+    _ensure_column(cursor, "weight_summary", "weeks", "INTEGER")
+    _ensure_column(cursor, "weight_summary", "computed_on", "TEXT")
+    cohorts.init_cohort_tables(cursor)
+
+
+def _weight_norm_field(week, height, start_weight, field):
+    norm = calculate_weight_norm(week, height, start_weight)
+    return norm[field] if norm else None
+
+
+@batch_job("pregnancy_weeks")
+def recompute_weeks(cursor, lower, upper, today):
+    """Недели и триместр от pregnancy_start на сегодня"""
+    cursor.execute("""
+        INSERT OR REPLACE INTO pregnancy_weeks (user_id, weeks, trimester, computed_on)
+        SELECT user_id, weeks,
+               CASE WHEN weeks < 14 THEN 1 WHEN weeks < 28 THEN 2 ELSE 3 END,
+               :today
+        FROM (
+            SELECT user_id,
+                   MAX(0, CAST((julianday(:today) - julianday(start_date)) / 7 AS INTEGER)) AS weeks
+            FROM pregnancy_start
+            WHERE user_id > :lower AND user_id <= :upper
+              AND julianday(start_date) IS NOT NULL
+        )
+    """, {"today": today, "lower": lower, "upper": upper})
+    return cursor.rowcount
+
+
+@batch_job("weight_summary")
+def recompute_weight_summary(cursor, lower, upper, today):
+    """ИМТ и коридор прибавки веса по свежим неделям"""
+    cursor.execute("""
+        INSERT OR REPLACE INTO weight_summary (user_id, bmi, bmi_category, min_kg, max_kg, weeks, computed_on)
+        SELECT user_id,
+               weight_norm(weeks, height, start_weight, 'bmi'),
+               weight_norm(weeks, height, start_weight, 'category'),
+               weight_norm(weeks, height, start_weight, 'min_kg'),
+               weight_norm(weeks, height, start_weight, 'max_kg'),
+               weeks, :today
+        FROM (
+            SELECT pw.user_id, pw.weeks, h.height,
+                   (SELECT w.weight FROM weights w
+                    WHERE w.user_id = pw.user_id
+                    ORDER BY w.date ASC LIMIT 1) AS start_weight
+            FROM pregnancy_weeks pw
+            JOIN user_height h ON h.user_id = pw.user_id
+            WHERE pw.user_id > :lower AND pw.user_id <= :upper
+              AND pw.computed_on = :today
+        )
+        WHERE weight_norm(weeks, height, start_weight, 'bmi') IS NOT NULL
+    """, {"today": today, "lower": lower, "upper": upper})
+    return cursor.rowcount
+
+
+@batch_job("cohort_percentiles", driver_table=None)
+def recompute_cohorts(cursor, lower, upper, today):
+    """Перцентили когорт по изменившимся неделям weekly_rollups"""
+    return cohorts.refresh_cohorts(cursor, today)
+
+
+def connect(db_path="pregnancy.db"):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.create_function("weight_norm", 4, _weight_norm_field, deterministic=True)
+    return conn
+
+
+def _claim(conn, job, run_date):
+    """Захватывает запуск задания; возвращает checkpoint или None, если запускать не нужно"""
+    now = datetime.now()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("SELECT status, checkpoint, heartbeat_at FROM batch_runs WHERE job = ? AND run_date = ?",
+                   (job, run_date))
+    row = cursor.fetchone()
+    if row and row[0] == "done":
+        conn.rollback()
+        return None
+    if row and row[0] == "running" and row[2] and now - datetime.fromisoformat(row[2]) < STALE_AFTER:
+        conn.rollback()
+        return None
+
+    if row:
+        # Продолжаем с сохранённого checkpoint
+        cursor.execute("""
+            UPDATE batch_runs SET status = 'running', heartbeat_at = ?
+            WHERE job = ? AND run_date = ?
+        """, (now.isoformat(), job, run_date))
+        checkpoint = row[1] or ""
+    else:
+        cursor.execute("""
+            INSERT INTO batch_runs (job, run_date, status, checkpoint, started_at, heartbeat_at)
+            VALUES (?, ?, 'running', '', ?, ?)
+        """, (job, run_date, now.isoformat(), now.isoformat()))
+        checkpoint = ""
+    conn.commit()
+    return checkpoint
+
+
+def run_job(conn, job, run_date, chunk_size=CHUNK_SIZE):
+    """Выполняет задание чанками по user_id; каждый чанк — своя короткая транзакция"""
+    checkpoint = _claim(conn, job["name"], run_date)
+    if checkpoint is None:
+        return None
+
+    cursor = conn.cursor()
+    total_rows = 0
+    chunks = 0
+    started = time.perf_counter()
+    while True:
+        if job["driver_table"] is None:
+            upper = WHOLE_RUN if checkpoint != WHOLE_RUN else None
+        else:
+            cursor.execute(f"""
+                SELECT MAX(user_id) FROM (
+                    SELECT user_id FROM {job['driver_table']}
+                    WHERE user_id > ? ORDER BY user_id LIMIT ?
+                )
+            """, (checkpoint, chunk_size))
+            upper = cursor.fetchone()[0]
+        if upper is None:
+            break
+
+        # Между чанками уступаем место запросам пользователей
+        with admission.slot("batch", timeout=None):
+            chunk_started = time.perf_counter()
+            cursor.execute("BEGIN IMMEDIATE")
+            rows = job["fn"](cursor, checkpoint, upper, run_date)
+            cursor.execute("""
+                UPDATE batch_runs
+                SET checkpoint = ?, rows = rows + ?, chunks = chunks + 1,
+                    heartbeat_at = ?, duration_ms = duration_ms + ?
+                WHERE job = ? AND run_date = ?
+            """, (upper, max(rows, 0), datetime.now().isoformat(),
+                  (time.perf_counter() - chunk_started) * 1000, job["name"], run_date))
+            conn.commit()
+
+        checkpoint = upper
+        total_rows += max(rows, 0)
+        chunks += 1
+
+    cursor.execute("""
+        UPDATE batch_runs SET status = 'done', finished_at = ?
+        WHERE job = ? AND run_date = ?
+    """, (datetime.now().isoformat(), job["name"], run_date))
+    conn.commit()
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"🗓️ Задание {job['name']}: {total_rows} строк, {chunks} чанков, {elapsed_ms:.0f} мс")
+    return {"rows": total_rows, "chunks": chunks, "duration_ms": elapsed_ms}
+
+
+def run_due_jobs(db_path="pregnancy.db", run_date=None):
+    """Запускает все задания за день, которые ещё не выполнены"""
+    run_date = run_date or date.today().isoformat()
+    conn = connect(db_path)
+    try:
+        init_batch_tables(conn.cursor())
+        conn.commit()
+        results = {}
+        for job in JOBS:
+            try:
+                results[job["name"]] = run_job(conn, job, run_date)
+            except Exception as e:
+                conn.rollback()
+                print(f"❌ Ошибка в задании {job['name']}: {e}")
+                results[job["name"]] = {"error": str(e)}
+                # Следующие задания зависят от предыдущих
+                break
+        return results
+    finally:
+        conn.close()
+
+
+def _seconds_until(run_at):
+    hour, minute = (int(part) for part in run_at.split(":"))
+    now = datetime.now()
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+def start_scheduler(db_path="pregnancy.db", run_at=RUN_AT):
+    """Фоновый поток: догоняет пропущенный запуск при старте, дальше — раз в сутки"""
+    def loop():
+        while True:
+            try:
+                run_due_jobs(db_path)
+            except Exception as e:
+                print(f"❌ Ошибка пакетных заданий: {e}")
+            time.sleep(_seconds_until(run_at))
+
+    thread = threading.Thread(target=loop, name="batch-jobs", daemon=True)
+    thread.start()
+    return thread
+
+
+def recent_runs(conn, limit=20):
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT job, run_date, status, rows, chunks, duration_ms, started_at, finished_at
+        FROM batch_runs
+        ORDER BY run_date DESC, started_at DESC
+        LIMIT ?
+    """, (limit,))
+    columns = ["job", "run_date", "status", "rows", "chunks", "duration_ms", "started_at", "finished_at"]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "run"
+
+    if command == "run":
+        run_date = sys.argv[2] if len(sys.argv) > 2 else None
+        print(run_due_jobs(run_date=run_date))
+    elif command == "status":
+        conn = connect()
+        for run in recent_runs(conn):
+            print(run)
+        conn.close()
+    else:
+        print("Использование: python batch_jobs.py [run [YYYY-MM-DD] | status]")
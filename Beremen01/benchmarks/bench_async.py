@@ -0,0 +1,190 @@
+"""Сколько запросов одновременно обслуживает один воркер: синхронный и ASGI-режим.
+
+Telegram подменяется локальным сервером с задержкой ответа. Каждый клиент по
+очереди шлёт /webhook с /start и /get_weights.
+
+Запуск: python benchmarks/bench_async.py [клиентов] [запросов на клиента]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+TELEGRAM_DELAY = 0.2
+
+
+class FakeTelegram(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(TELEGRAM_DELAY)
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_telegram():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTelegram)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_port
+
+
+def request_plan(client, count):
+    plan = []
+    for i in range(count):
+        if i % 2 == 0:
+            body = {"message": {"chat": {"id": client}, "text": "/start"}}
+            plan.append(("POST", "/webhook", json.dumps(body).encode()))
+        else:
+            plan.append(("GET", f"/get_weights?user_id=bench{client}", b""))
+    return plan
+
+
+def report(name, latencies, elapsed):
+    latencies.sort()
+    throughput = len(latencies) / elapsed
+    # Закон Литтла: среднее число запросов в работе = пропускная способность × время ответа
+    in_flight = throughput * (sum(latencies) / len(latencies))
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(f"{name:<34}{throughput:>10.1f}{p50:>10.1f}{p95:>10.1f}{in_flight:>14.2f}")
+
+
+def run_http(name, port, clients, count):
+    latencies = []
+    lock = threading.Lock()
+
+    def client(index):
+        session = requests.Session()
+        for method, path, body in request_plan(index, count):
+            started = time.perf_counter()
+            session.request(method, f"http://127.0.0.1:{port}{path}", data=body,
+                            headers={"Content-Type": "application/json"})
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report(name, latencies, time.perf_counter() - started)
+
+
+def serve_wsgi(app):
+    """Один поток — как один синхронный воркер gunicorn"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, app, threaded=False, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_asgi_inprocess(app, clients, count):
+    """Без uvicorn: те же запросы напрямую в ASGI-приложение"""
+    latencies = []
+
+    async def call(method, path, body):
+        path, _, query = path.partition("?")
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            pass
+
+        scope = {
+            "type": "http", "method": method, "path": path, "query_string": query.encode(),
+            "headers": [(b"host", b"127.0.0.1"), (b"content-type", b"application/json")],
+            "server": ("127.0.0.1", 80), "client": ("127.0.0.1", 0),
+        }
+        await app(scope, receive, send)
+
+    async def client(index):
+        for method, path, body in request_plan(index, count):
+            started = time.perf_counter()
+            await call(method, path, body)
+            latencies.append(time.perf_counter() - started)
+
+    async def run():
+        await asyncio.gather(*(client(i) for i in range(clients)))
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    report("asgi (в процессе)", latencies, time.perf_counter() - started)
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{start_fake_telegram()}"
+    os.environ["TELEGRAM_BOT_TOKEN"] = "bench"
+    workdir = tempfile.mkdtemp(prefix="bench-async-")
+    os.chdir(workdir)
+
+    import async_runtime
+    import main as web
+    import asgi
+
+    print(f"Клиентов: {clients}, запросов на клиента: {count}, задержка Telegram: {TELEGRAM_DELAY * 1000:.0f} мс")
+    header = f"{'режим (1 воркер)':<34}{'запр/с':>10}{'p50 мс':>10}{'p95 мс':>10}{'одновременно':>14}"
+    print(header)
+    print("-" * len(header))
+
+    # Как было до async_runtime: обработчик ждёт ответа Telegram
+    post_nowait = async_runtime.post_nowait
+    async_runtime.post_nowait = async_runtime.post_sync
+    server = serve_wsgi(web.app)
+    run_http("wsgi, отправка в обработчике", server.server_port, clients, count)
+    server.shutdown()
+    async_runtime.post_nowait = post_nowait
+
+    server = serve_wsgi(web.app)
+    run_http("wsgi, отправка в фоне", server.server_port, clients, count)
+    server.shutdown()
+
+    try:
+        import uvicorn
+    except ImportError:
+        uvicorn = None
+
+    if uvicorn is None:
+        run_asgi_inprocess(asgi.app, clients, count)
+        print("uvicorn не установлен: ASGI измерен без сетевого сервера")
+    else:
+        config = uvicorn.Config(asgi.app, host="127.0.0.1", port=0, log_level="warning", lifespan="off")
+        server = uvicorn.Server(config)
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+        port = server.servers[0].sockets[0].getsockname()[1]
+        run_http("asgi (uvicorn)", port, clients, count)
+        server.should_exit = True
+        thread.join()
+
+    async_runtime.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Сравнение размера и времени сериализации: строки vs колонки, json vs orjson.
+
+Запуск: python benchmarks/bench_wire_format.py [дней истории]
+"""
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import wire_format  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+REPEAT = 200
+
+
+def make_rows(days, fields):
+    start = date(2024, 1, 1)
+    rows = []
+    for i in range(days):
+        if random.random() < 0.15:
+            continue  # пропущенные дни, как в реальных данных
+        day = (start + timedelta(days=i)).isoformat()
+        if fields == ["weight"]:
+            rows.append((day, round(60 + i * 0.05 + random.uniform(-0.5, 0.5), 1)))
+        elif fields == ["systolic", "diastolic"]:
+            rows.append((day, random.randint(105, 140), random.randint(65, 92)))
+        elif fields == ["mood", "wellbeing"]:
+            rows.append((day, random.randint(1, 5), random.randint(1, 5)))
+        else:
+            rows.append((day, round(random.uniform(3.8, 6.5), 1)))
+    return rows
+
+
+def timed(fn):
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        fn()
+    return (time.perf_counter() - started) / REPEAT * 1e6
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 280
+    random.seed(42)
+    brotli = wire_format.brotli
+
+    print(f"История: {days} дней, повторов: {REPEAT}, orjson: {'да' if orjson else 'нет'}, brotli: {'да' if brotli else 'нет'}")
+    header = f"{'эндпоинт':<20}{'формат':<10}{'байт':>8}{'gzip':>8}{'br':>8}{'json мкс':>10}{'orjson мкс':>12}"
+    print(header)
+    print("-" * len(header))
+
+    endpoints = {
+        "/get_weights": ["weight"],
+        "/load_pressure_data": ["systolic", "diastolic"],
+        "/load_mood_data": ["mood", "wellbeing"],
+        "/load_sugar_data": ["sugar"],
+    }
+    for endpoint, fields in endpoints.items():
+        rows = make_rows(days, fields)
+        block = wire_format.to_columnar(rows, fields)
+        assert [list(r) for r in rows] == wire_format.from_columnar(block)
+
+        for name, payload, encode in (
+            ("rows", rows, lambda: rows),
+            ("columnar", block, lambda: wire_format.to_columnar(rows, fields)),
+        ):
+            body = stdlib_dumps(payload)
+            gz = len(gzip.compress(body, compresslevel=wire_format.GZIP_LEVEL))
+            br = len(brotli.compress(body, quality=wire_format.BROTLI_QUALITY)) if brotli else "-"
+            json_us = timed(lambda: stdlib_dumps(encode()))
+            orjson_us = timed(lambda: orjson.dumps(encode())) if orjson else float("nan")
+            print(f"{endpoint:<20}{name:<10}{len(body):>8}{gz:>8}{br:>8}{json_us:>10.1f}{orjson_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import bisect
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+# Сахар натощак выше этого порога — критерий гестационного диабета (ммоль/л)
+SUGAR_HIGH = 5.1
+PRESSURE_HIGH_SYSTOLIC = 140
+PRESSURE_HIGH_DIASTOLIC = 90
+# Алерт давления учитывается, если он был за последние ALERT_RECENT_DAYS дней
+ALERT_RECENT_DAYS = 7
+
+# Вклад в оценку риска, по ней сортируется список пациентов
+RISK_POINTS = {
+    "severe": 8,
+    "persistent": 6,
+    "hypertension": 4,
+    "above_baseline": 2,
+    "pressure_high": 2,
+    "sugar_high": 2,
+    "weight_out_of_range": 1,
+}
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+MAX_USER_IDS = 5000
+
+# Порядок пациентов первой страницы хранится для следующих страниц того же запроса:
+# курсор ссылается на него, и риск всего списка не пересчитывается на каждой странице
+RANKING_TTL = float(os.environ.get("CLINICIAN_RANKING_TTL", 300))
+MAX_RANKINGS = 32
+
+_lock = threading.Lock()
+_rankings = OrderedDict()
+
+# Оценка риска по флагам из CTE flagged — одна формула для ранжирования и для страницы
+_RISK = """
+    CASE alert_level
+        WHEN 'severe' THEN :risk_severe
+        WHEN 'persistent' THEN :risk_persistent
+        WHEN 'hypertension' THEN :risk_hypertension
+        WHEN 'above_baseline' THEN :risk_above_baseline
+        ELSE 0
+    END
+    + pressure_high * :risk_pressure_high
+    + sugar_high * :risk_sugar_high
+    + weight_out_of_range * :risk_weight_out_of_range
+"""
+
+_ALERT_LEVEL = """
+    CASE WHEN pas.alert_date >= date(:today, '-' || :alert_days || ' days') THEN pas.alert_level END
+"""
+
+# Ранжирование всего списка: только то, что входит в оценку риска, — по одному поиску
+# по индексу (user_id, date) на показатель. Выполняется один раз на запрос врача,
+# следующие страницы берут порядок из кэша по курсору.
+_RANK_SQL = """
+    WITH patients(user_id) AS (
+        {patients}
+    ),
+    latest AS (
+        SELECT p.user_id,
+               (SELECT pe.systolic >= :sys_high OR pe.diastolic >= :dia_high
+                FROM pressure_entries pe WHERE pe.user_id = p.user_id
+                ORDER BY pe.date DESC LIMIT 1) AS pressure_high,
+               (SELECT s.sugar > :sugar_high FROM sugar_entries s WHERE s.user_id = p.user_id
+                ORDER BY s.date DESC LIMIT 1) AS sugar_high,
+               (SELECT w.weight FROM weights w WHERE w.user_id = p.user_id
+                ORDER BY w.date DESC LIMIT 1) AS weight,
+               (SELECT w.weight FROM weights w WHERE w.user_id = p.user_id
+                ORDER BY w.date ASC LIMIT 1) AS start_weight
+        FROM patients p
+    ),
+    flagged AS (
+        SELECT l.user_id,
+               {alert_level} AS alert_level,
+               COALESCE(l.pressure_high, 0) AS pressure_high,
+               COALESCE(l.sugar_high, 0) AS sugar_high,
+               COALESCE(l.weight - l.start_weight < ws.min_kg OR l.weight - l.start_weight > ws.max_kg, 0)
+                   AS weight_out_of_range
+        FROM latest l
+        LEFT JOIN weight_summary ws ON ws.user_id = l.user_id
+        LEFT JOIN pressure_alert_state pas ON pas.user_id = l.user_id
+    )
+    SELECT user_id, {risk} AS risk FROM flagged
+    WHERE user_id IS NOT NULL
+    ORDER BY risk DESC, user_id ASC
+"""
+
+# Подробности — только для пациентов одной страницы. Неделя — из pregnancy_weeks,
+# которую ведёт ночное задание batch_jobs.
+_PAGE_SQL = """
+    WITH patients(user_id) AS (
+        SELECT DISTINCT CAST(value AS TEXT) FROM json_each(:page_ids)
+    ),
+    latest AS (
+        SELECT p.user_id,
+               (SELECT w.id FROM weights w WHERE w.user_id = p.user_id
+                ORDER BY w.date DESC LIMIT 1) AS weight_id,
+               (SELECT w.weight FROM weights w WHERE w.user_id = p.user_id
+                ORDER BY w.date ASC LIMIT 1) AS start_weight,
+               (SELECT pe.id FROM pressure_entries pe WHERE pe.user_id = p.user_id
+                ORDER BY pe.date DESC LIMIT 1) AS pressure_id,
+               (SELECT s.rowid FROM sugar_entries s WHERE s.user_id = p.user_id
+                ORDER BY s.date DESC LIMIT 1) AS sugar_rowid,
+               (SELECT m.rowid FROM mood_entries m WHERE m.user_id = p.user_id
+                ORDER BY m.date DESC LIMIT 1) AS mood_rowid
+        FROM patients p
+    ),
+    flagged AS (
+        SELECT l.user_id,
+               MAX(0, pw.weeks) AS week,
+               w.date AS weight_date, w.weight, l.start_weight, ws.min_kg, ws.max_kg,
+               pe.date AS pressure_date, pe.systolic, pe.diastolic,
+               s.date AS sugar_date, s.sugar,
+               m.date AS mood_date, m.mood, m.wellbeing,
+               {alert_level} AS alert_level,
+               pas.alert_date,
+               EXISTS (SELECT 1 FROM weights x WHERE x.user_id = l.user_id AND x.date = :today) AS weight_today,
+               EXISTS (SELECT 1 FROM pressure_entries x WHERE x.user_id = l.user_id AND x.date = :today) AS pressure_today,
+               EXISTS (SELECT 1 FROM mood_entries x WHERE x.user_id = l.user_id AND x.date = :today) AS mood_today,
+               EXISTS (SELECT 1 FROM sugar_entries x WHERE x.user_id = l.user_id AND x.date = :today) AS sugar_today,
+               COALESCE(pe.systolic >= :sys_high OR pe.diastolic >= :dia_high, 0) AS pressure_high,
+               COALESCE(s.sugar > :sugar_high, 0) AS sugar_high,
+               COALESCE(w.weight - l.start_weight < ws.min_kg OR w.weight - l.start_weight > ws.max_kg, 0)
+                   AS weight_out_of_range
+        FROM latest l
+        LEFT JOIN pregnancy_weeks pw ON pw.user_id = l.user_id
+        LEFT JOIN weights w ON w.id = l.weight_id
+        LEFT JOIN pressure_entries pe ON pe.id = l.pressure_id
+        LEFT JOIN sugar_entries s ON s.rowid = l.sugar_rowid
+        LEFT JOIN mood_entries m ON m.rowid = l.mood_rowid
+        LEFT JOIN weight_summary ws ON ws.user_id = l.user_id
+        LEFT JOIN pressure_alert_state pas ON pas.user_id = l.user_id
+    )
+    SELECT * FROM flagged
+"""
+
+_ALL_PATIENTS = "SELECT user_id FROM users WHERE user_id IS NOT NULL UNION SELECT user_id FROM pregnancy_start"
+_LISTED_PATIENTS = "SELECT DISTINCT CAST(value AS TEXT) FROM json_each(:user_ids)"
+
+
+def encode_cursor(risk, user_id, ranking=None):
+    return f"{risk}:{user_id}:{ranking}" if ranking else f"{risk}:{user_id}"
+
+
+def decode_cursor(token):
+    """'риск:user_id[:ранжирование]' -> (риск, user_id, ранжирование или None); ValueError для неверного"""
+    risk, sep, rest = token.partition(":")
+    user_id, _, ranking = rest.partition(":")
+    if not sep or not user_id:
+        raise ValueError(token)
+    return int(risk), user_id, ranking or None
+
+
+def _cached_ranking(ranking_id, roster_key):
+    with _lock:
+        entry = _rankings.get(ranking_id)
+        if entry is None:
+            return None
+        expires_at, key, ranked = entry
+        if expires_at < time.monotonic() or key != roster_key:
+            del _rankings[ranking_id]
+            return None
+        # Вытесняется давно не запрошенный порядок, а не тот, что сейчас листают
+        _rankings.move_to_end(ranking_id)
+        return ranked
+
+
+def _store_ranking(roster_key, ranked):
+    ranking_id = secrets.token_hex(4)
+    with _lock:
+        _rankings[ranking_id] = (time.monotonic() + RANKING_TTL, roster_key, ranked)
+        while len(_rankings) > MAX_RANKINGS:
+            _rankings.popitem(last=False)
+    return ranking_id
+
+
+def _rank(conn, params, user_ids):
+    """[(−риск, user_id)] по возрастанию — в порядке выдачи"""
+    sql = _RANK_SQL.format(patients=_LISTED_PATIENTS if user_ids is not None else _ALL_PATIENTS,
+                           alert_level=_ALERT_LEVEL, risk=_RISK)
+    return [(-risk, user_id) for user_id, risk in conn.execute(sql, params)]
+
+
+def _patient(row):
+    return {
+        "user_id": row["user_id"],
+        "week": row["week"],
+        "risk": row["risk"],
+        "latest": {
+            "weight": {"date": row["weight_date"], "weight": row["weight"]} if row["weight_date"] else None,
+            "pressure": {
+                "date": row["pressure_date"],
+                "systolic": row["systolic"],
+                "diastolic": row["diastolic"],
+            } if row["pressure_date"] else None,
+            "sugar": {"date": row["sugar_date"], "sugar": row["sugar"]} if row["sugar_date"] else None,
+            "mood": {
+                "date": row["mood_date"],
+                "mood": row["mood"],
+                "wellbeing": row["wellbeing"],
+            } if row["mood_date"] else None,
+        },
+        "status": {
+            "weight_today": bool(row["weight_today"]),
+            "pressure_today": bool(row["pressure_today"]),
+            "mood_today": bool(row["mood_today"]),
+            "sugar_today": bool(row["sugar_today"]),
+        },
+        "flags": {
+            "pressure_alert": row["alert_level"],
+            "pressure_high": bool(row["pressure_high"]),
+            "sugar_high": bool(row["sugar_high"]),
+            "weight_out_of_range": bool(row["weight_out_of_range"]),
+        },
+        "weight_gain": round(row["weight"] - row["start_weight"], 1)
+        if row["weight"] is not None and row["start_weight"] is not None else None,
+        "weight_norm": {"min_kg": row["min_kg"], "max_kg": row["max_kg"]} if row["min_kg"] is not None else None,
+    }
+
+
+def overview(conn, today, user_ids=None, cursor_token=None, limit=DEFAULT_PAGE_SIZE):
+    """Страница пациентов по убыванию риска; next_cursor — для следующей страницы.
+
+    Первая страница ранжирует весь список одним запросом и кэширует порядок на
+    RANKING_TTL секунд; курсор следующих страниц ссылается на него. Если порядок
+    уже вытеснен или курсор пришёл в другой воркер, список ранжируется заново и
+    продолжается с того же места (риск, user_id).
+    """
+    after_risk, after_user, ranking_id = decode_cursor(cursor_token) if cursor_token else (None, None, None)
+    params = {
+        "today": today,
+        "alert_days": ALERT_RECENT_DAYS,
+        "sys_high": PRESSURE_HIGH_SYSTOLIC,
+        "dia_high": PRESSURE_HIGH_DIASTOLIC,
+        "sugar_high": SUGAR_HIGH,
+        **{f"risk_{name}": points for name, points in RISK_POINTS.items()},
+    }
+    if user_ids is not None:
+        params["user_ids"] = json.dumps([str(user_id) for user_id in user_ids])
+    roster_key = (today, params.get("user_ids"))
+
+    ranked = _cached_ranking(ranking_id, roster_key) if ranking_id else None
+    if ranked is None:
+        ranked = _rank(conn, params, user_ids)
+        ranking_id = _store_ranking(roster_key, ranked)
+
+    start = 0 if after_risk is None else bisect.bisect_right(ranked, (-after_risk, after_user))
+    # Одна лишняя строка показывает, есть ли следующая страница
+    page = ranked[start:start + limit + 1]
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    rows = {}
+    if page:
+        cursor = conn.cursor()
+        cursor.execute(_PAGE_SQL.format(alert_level=_ALERT_LEVEL),
+                       {**params, "page_ids": json.dumps([user_id for _, user_id in page])})
+        columns = [column[0] for column in cursor.description]
+        rows = {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+
+    patients = []
+    for negative_risk, user_id in page:
+        row = rows.get(user_id)
+        if row is None:
+            continue
+        # Риск — из ранжирования, чтобы порядок страниц не расходился с выдачей
+        row["risk"] = -negative_risk
+        patients.append(_patient(row))
+
+    next_cursor = None
+    if has_more:
+        negative_risk, user_id = page[-1]
+        next_cursor = encode_cursor(-negative_risk, user_id, ranking_id)
+    return {"patients": patients, "next_cursor": next_cursor}
@@ -0,0 +1,295 @@
+import os
+import sqlite3
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Показатель когорты -> метрика weekly_rollups
+COHORT_METRICS = {
+    "weight_gain": "weight",
+    "systolic": "systolic",
+    "diastolic": "diastolic",
+    "sugar": "sugar",
+}
+ALL_CATEGORIES = "all"
+# Меньшие когорты не сохраняем: перцентили по 2-3 людям ничего не значат
+MIN_COHORT_SIZE = int(os.environ.get("COHORT_MIN_SIZE", 5))
+# По воскресеньям пересчитываем всё: так учитываются смены категории ИМТ и удалённые недели
+FULL_REFRESH_WEEKDAY = 6
+PERCENTILES = 101
+
+# Значение пользователя за неделю: прибавка от первого веса или среднее за неделю
+_VALUES_SQL = """
+    SELECT r.metric, r.pregnancy_week, COALESCE(ws.bmi_category, 'unknown'),
+           CASE WHEN r.metric = 'weight'
+                THEN r.last_value - (SELECT w.weight FROM weights w
+                                     WHERE w.user_id = r.user_id
+                                     ORDER BY w.date ASC LIMIT 1)
+                ELSE r.value_sum / r.value_count END
+    FROM weekly_rollups r
+    LEFT JOIN weight_summary ws ON ws.user_id = r.user_id
+    WHERE r.metric IN ({metrics}) AND r.value_count > 0 {extra_where}
+"""
+
+
+def init_cohort_tables(cursor):
+    """101 перцентиль (0..100) на когорту: float32 в BLOB, ~400 байт на строку"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cohort_percentiles (
+            metric TEXT,
+            pregnancy_week INTEGER,
+            bmi_category TEXT,
+            sample_size INTEGER,
+            percentiles BLOB,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (metric, pregnancy_week, bmi_category)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cohort_refresh (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            watermark TEXT,
+            refreshed_at TEXT
+        )
+    """)
+
+
+def _pack(values):
+    packed = array("f", values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(blob):
+    values = array("f")
+    values.frombytes(blob)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _percentiles_numpy(keys, values):
+    """Все когорты сразу: сортировка по (когорта, значение) и линейная интерполяция"""
+    key_index = {key: i for i, key in enumerate(sorted(set(keys)))}
+    codes = np.fromiter((key_index[key] for key in keys), dtype=np.int64, count=len(keys))
+    values = np.asarray(values, dtype=np.float64)
+
+    order = np.lexsort((values, codes))
+    codes, values = codes[order], values[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    sizes = np.diff(np.r_[starts, len(codes)])
+
+    # Позиции перцентилей внутри каждой группы — тот же метод, что np.percentile(..., "linear")
+    position = starts[:, None] + (sizes[:, None] - 1) * np.arange(PERCENTILES)[None, :] / 100.0
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, (starts + sizes - 1)[:, None])
+    fraction = position - lower
+    table = values[lower] + (values[upper] - values[lower]) * fraction
+
+    keys_sorted = sorted(key_index, key=key_index.get)
+    return {key: (int(sizes[i]), table[i].astype(np.float32).tolist()) for i, key in enumerate(keys_sorted)}
+
+
+def _percentiles_python(keys, values):
+    groups = {}
+    for key, value in zip(keys, values):
+        groups.setdefault(key, []).append(value)
+    result = {}
+    for key, group in groups.items():
+        group.sort()
+        n = len(group)
+        table = []
+        for q in range(PERCENTILES):
+            position = (n - 1) * q / 100
+            lower = int(position)
+            upper = min(lower + 1, n - 1)
+            table.append(group[lower] + (group[upper] - group[lower]) * (position - lower))
+        result[key] = (n, table)
+    return result
+
+
+def compute_percentiles(keys, values):
+    """{когорта: (размер, [p0..p100])}; NumPy, если установлен"""
+    if not keys:
+        return {}
+    if np is not None:
+        return _percentiles_numpy(keys, values)
+    return _percentiles_python(keys, values)
+
+
+def _load_values(cursor, dirty=None):
+    names = {source: metric for metric, source in COHORT_METRICS.items()}
+    params = list(names)
+    extra_where = ""
+    if dirty is not None:
+        extra_where = "AND (r.metric || ':' || r.pregnancy_week) IN ({})".format(",".join("?" * len(dirty)))
+        params += [f"{source}:{week}" for source, week in dirty]
+    cursor.execute(_VALUES_SQL.format(metrics=",".join("?" * len(names)), extra_where=extra_where), params)
+
+    keys, values = [], []
+    for source, week, category, value in cursor.fetchall():
+        if value is None:
+            continue
+        metric = names[source]
+        keys.append((metric, week, category))
+        values.append(value)
+        keys.append((metric, week, ALL_CATEGORIES))
+        values.append(value)
+    return keys, values
+
+
+def refresh_cohorts(cursor, today=None, full=False):
+    """Пересчитывает когорты недель, чьи агрегаты изменились после прошлого запуска"""
+    today = today or date.today().isoformat()
+    cursor.execute("SELECT watermark FROM cohort_refresh WHERE id = 1")
+    row = cursor.fetchone()
+    watermark = row[0] if row else None
+    if watermark is None or date.fromisoformat(today).weekday() == FULL_REFRESH_WEEKDAY:
+        full = True
+
+    # Строки текущей секунды ещё могут меняться — их захватит и следующий запуск
+    cursor.execute("SELECT MIN(MAX(updated_at), datetime('now', '-1 second')) FROM weekly_rollups")
+    new_watermark = cursor.fetchone()[0]
+
+    sources = list(COHORT_METRICS.values())
+    if full:
+        dirty = None
+    else:
+        cursor.execute(f"""
+            SELECT DISTINCT metric, pregnancy_week FROM weekly_rollups
+            WHERE updated_at > ? AND metric IN ({",".join("?" * len(sources))})
+        """, (watermark, *sources))
+        dirty = cursor.fetchall()
+        if not dirty:
+            _store_watermark(cursor, new_watermark or watermark, today)
+            return 0
+
+    keys, values = _load_values(cursor, dirty)
+    tables = compute_percentiles(keys, values)
+
+    names = {source: metric for metric, source in COHORT_METRICS.items()}
+    if dirty is None:
+        cursor.execute("DELETE FROM cohort_percentiles")
+    else:
+        cursor.executemany(
+            "DELETE FROM cohort_percentiles WHERE metric = ? AND pregnancy_week = ?",
+            [(names[source], week) for source, week in dirty]
+        )
+    rows = [
+        (metric, week, category, size, _pack(table))
+        for (metric, week, category), (size, table) in tables.items()
+        if size >= MIN_COHORT_SIZE
+    ]
+    cursor.executemany("""
+        INSERT INTO cohort_percentiles (metric, pregnancy_week, bmi_category, sample_size, percentiles, updated_at)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """, rows)
+    _store_watermark(cursor, new_watermark, today)
+    return len(rows)
+
+
+def _store_watermark(cursor, watermark, today):
+    cursor.execute("""
+        INSERT INTO cohort_refresh (id, watermark, refreshed_at) VALUES (1, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET watermark = excluded.watermark, refreshed_at = excluded.refreshed_at
+    """, (watermark, today))
+
+
+def percentile_of(table, value):
+    """Место значения среди 101 сохранённого перцентиля (0..100)"""
+    lo = bisect_left(table, value)
+    hi = bisect_right(table, value)
+    if lo != hi:
+        # Значение совпало с несколькими перцентилями — берём середину
+        return round((lo + hi - 1) / 2, 1)
+    if lo == 0:
+        return 0.0
+    if lo == len(table):
+        return 100.0
+    below, above = table[lo - 1], table[lo]
+    return round(lo - 1 + (value - below) / (above - below), 1)
+
+
+def user_percentiles(cursor, user_id, week):
+    """Перцентили пользователя на неделе week — только поиски по первичным ключам"""
+    cursor.execute("SELECT bmi_category FROM weight_summary WHERE user_id = ?", (user_id,))
+    row = cursor.fetchone()
+    category = row[0] if row and row[0] else "unknown"
+
+    cursor.execute("SELECT weight FROM weights WHERE user_id = ? ORDER BY date ASC LIMIT 1", (user_id,))
+    row = cursor.fetchone()
+    start_weight = row[0] if row else None
+
+    result = {}
+    for metric, source in COHORT_METRICS.items():
+        # Текущая неделя или последняя неделя до неё, за которую есть данные
+        cursor.execute("""
+            SELECT pregnancy_week, value_sum / value_count, last_value FROM weekly_rollups
+            WHERE user_id = ? AND metric = ? AND pregnancy_week <= ? AND value_count > 0
+            ORDER BY pregnancy_week DESC
+            LIMIT 1
+        """, (user_id, source, week))
+        row = cursor.fetchone()
+        if row is None:
+            result[metric] = None
+            continue
+        value_week = row[0]
+        if metric == "weight_gain":
+            value = row[2] - start_weight if start_weight is not None and row[2] is not None else None
+        else:
+            value = row[1]
+        if value is None:
+            result[metric] = None
+            continue
+
+        # Своя категория ИМТ, а если когорта маленькая — все пользователи этой недели
+        cursor.execute("""
+            SELECT bmi_category, sample_size, percentiles FROM cohort_percentiles
+            WHERE metric = ? AND pregnancy_week = ? AND bmi_category IN (?, ?)
+            ORDER BY bmi_category = ? DESC
+            LIMIT 1
+        """, (metric, value_week, category, ALL_CATEGORIES, category))
+        cohort = cursor.fetchone()
+        if cohort is None:
+            result[metric] = {"week": value_week, "value": round(value, 2), "percentile": None}
+            continue
+        table = _unpack(cohort[2])
+        result[metric] = {
+            "week": value_week,
+            "value": round(value, 2),
+            "percentile": percentile_of(table, value),
+            "median": round(table[50], 2),
+            "cohort": cohort[0],
+            "cohort_size": cohort[1],
+        }
+    return {"week": week, "bmi_category": category, "metrics": result}
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "refresh"
+    conn = sqlite3.connect("pregnancy.db", timeout=30)
+    cursor = conn.cursor()
+    init_cohort_tables(cursor)
+
+    if command in ("refresh", "rebuild"):
+        count = refresh_cohorts(cursor, full=command == "rebuild")
+        conn.commit()
+        print(f"📈 Пересчитано когорт: {count} ({'NumPy' if np is not None else 'без NumPy'})")
+    elif command == "show" and len(sys.argv) > 3:
+        cursor.execute("""
+            SELECT bmi_category, sample_size, percentiles FROM cohort_percentiles
+            WHERE metric = ? AND pregnancy_week = ?
+        """, (sys.argv[2], int(sys.argv[3])))
+        for category, size, blob in cursor.fetchall():
+            table = _unpack(blob)
+            print(f"{category:<12} n={size:<6} p10={table[10]:.2f} p50={table[50]:.2f} p90={table[90]:.2f}")
+    else:
+        print("Использование: python cohorts.py [refresh | rebuild | show <метрика> <неделя>]")
+    conn.close()
@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import admission
+
+# Пустой комментарий раз в HEARTBEAT секунд: прокси не рвут соединение, а мы узнаём об отключении клиента
+HEARTBEAT = float(os.environ.get("SSE_HEARTBEAT", 15))
+# Каждый поток занимает поток воркера — больше этого числа подписчиков не принимаем
+MAX_SUBSCRIBERS = int(os.environ.get("SSE_MAX_SUBSCRIBERS", 64))
+# Через столько секунд поток закрывается, браузер переподключится с Last-Event-ID
+MAX_STREAM_SECONDS = float(os.environ.get("SSE_MAX_STREAM_SECONDS", 600))
+RETRY_AFTER = int(os.environ.get("SSE_RETRY_AFTER", 30))
+RECONNECT_MS = 3000
+
+# Для возобновления храним последние BACKLOG событий каждого из BUFFERED_USERS пользователей
+BACKLOG = int(os.environ.get("SSE_BACKLOG", 50))
+BUFFERED_USERS = int(os.environ.get("SSE_BUFFERED_USERS", 1000))
+
+# Номера событий действительны только в этом процессе: после перезапуска или
+# переподключения к другому воркеру клиент получит reset и перечитает данные
+EPOCH = f"{os.getpid():x}{int(time.time()):x}"
+
+_lock = threading.Lock()
+_last_id = 0
+_buffers = OrderedDict()
+# Номер последнего вытесненного из буфера события пользователя
+_dropped = {}
+# То же для пользователей, чей буфер удалён целиком
+_evicted_upto = 0
+_subscribers = {}
+_count = 0
+
+
+def _frame(event_id, kind, data):
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return f"id: {EPOCH}-{event_id}\nevent: {kind}\ndata: {payload}\n\n"
+
+
+def _evict_buffers():
+    global _evicted_upto
+    for user_id in list(_buffers):
+        if len(_buffers) <= BUFFERED_USERS:
+            return
+        if user_id in _subscribers:
+            continue
+        buffer = _buffers.pop(user_id)
+        _evicted_upto = max(_evicted_upto, buffer[-1][0])
+        _dropped.pop(user_id, None)
+
+
+def publish(user_id, kind, data):
+    """Новая или изменённая запись пользователя; вызывается после commit"""
+    global _last_id
+    user_id = str(user_id)
+    with _lock:
+        _last_id += 1
+        event_id = _last_id
+        buffer = _buffers.get(user_id)
+        if buffer is None:
+            buffer = _buffers[user_id] = deque(maxlen=BACKLOG)
+        else:
+            _buffers.move_to_end(user_id)
+        if len(buffer) == BACKLOG:
+            _dropped[user_id] = buffer[0][0]
+        buffer.append((event_id, kind, data))
+        _evict_buffers()
+        subscribers = list(_subscribers.get(user_id, ()))
+    for subscription in subscribers:
+        subscription.wake()
+    return event_id
+
+
+def _resume_point(user_id, last_event_id):
+    """Номер, после которого продолжать поток, или None — пропущенное уже не восстановить"""
+    epoch, _, number = last_event_id.partition("-")
+    if epoch != EPOCH or not number.isdigit():
+        return None
+    number = int(number)
+    lost = _dropped.get(user_id, 0) if user_id in _buffers else _evicted_upto
+    return number if number >= lost else None
+
+
+class Subscription:
+    def __init__(self, user_id, notify=None):
+        self.user_id = user_id
+        self.last_id = 0
+        self.reset = False
+        self._event = threading.Event()
+        self._notify = notify or self._event.set
+
+    def wake(self):
+        self._notify()
+
+    def poll(self):
+        """Кадры SSE, накопившиеся после прошлого вызова ('' — ничего нового)"""
+        frames = []
+        with _lock:
+            if self.reset:
+                self.reset = False
+                frames.append(_frame(self.last_id, "reset", {}))
+            for event_id, kind, data in _buffers.get(self.user_id, ()):
+                if event_id > self.last_id:
+                    frames.append(_frame(event_id, kind, data))
+                    self.last_id = event_id
+        return "".join(frames)
+
+    def wait(self, timeout):
+        """Ждёт новых событий не дольше timeout секунд"""
+        self._event.wait(timeout)
+        self._event.clear()
+        return self.poll()
+
+    def close(self):
+        global _count
+        with _lock:
+            subscribers = _subscribers.get(self.user_id)
+            if subscribers is None or self not in subscribers:
+                return
+            subscribers.discard(self)
+            if not subscribers:
+                del _subscribers[self.user_id]
+            _count -= 1
+
+
+def subscribe(user_id, last_event_id=None, notify=None):
+    """Регистрирует подписчика; при превышении MAX_SUBSCRIBERS — admission.Overloaded.
+
+    Без Last-Event-ID поток начинается с новых событий. С ним — досылаются
+    пропущенные, а если их уже не восстановить, первым приходит событие reset.
+    """
+    global _count
+    user_id = str(user_id)
+    subscription = Subscription(user_id, notify)
+    with _lock:
+        if _count >= MAX_SUBSCRIBERS:
+            raise admission.Overloaded("sse_subscribers", RETRY_AFTER)
+        subscription.last_id = _last_id
+        if last_event_id:
+            resume = _resume_point(user_id, last_event_id)
+            if resume is None:
+                subscription.reset = True
+            else:
+                subscription.last_id = resume
+        _subscribers.setdefault(user_id, set()).add(subscription)
+        _count += 1
+    return subscription
+
+
+def stream(subscription):
+    """Генератор кадров SSE для синхронного воркера.
+
+    Подписку закрывает вызывающий (Response.call_on_close): генератор, который
+    ни разу не запускался, свой finally не выполнит.
+    """
+    try:
+        yield f"retry: {RECONNECT_MS}\n\n"
+        deadline = time.monotonic() + MAX_STREAM_SECONDS
+        last_sent = time.monotonic()
+        chunk = subscription.poll()
+        while True:
+            if chunk:
+                yield chunk
+                last_sent = time.monotonic()
+            elif time.monotonic() >= last_sent + HEARTBEAT:
+                yield ": ping\n\n"
+                last_sent = time.monotonic()
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            chunk = subscription.wait(min(last_sent + HEARTBEAT, deadline) - now)
+    finally:
+        subscription.close()
+
+
+def report():
+    with _lock:
+        return {
+            "subscribers": _count,
+            "max_subscribers": MAX_SUBSCRIBERS,
+            "users_subscribed": len(_subscribers),
+            "users_buffered": len(_buffers),
+            "last_event_id": f"{EPOCH}-{_last_id}",
+        }
@@ -1,9 +1,29 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 import sqlite3
 from datetime import date, datetime
 import re
 import os
-import requests
+import threading
+import time
+from functools import wraps
+
+import admission
+import async_runtime
+import backup
+import batch_jobs
+import clinician
+import cohorts
+import live_events
+import memory_guard
+import page_cache
+from pregnancy_norms import calculate_weight_norm, pregnancy_week, trimester
+import pressure_alerts
+import rate_limit
+import request_stats
+import schemas
+import traffic_capture
+import weekly_rollups
+import wire_format
 
 app = Flask(__name__, static_folder="static")
 
@@ -72,6 +92,37 @@ def validate_date(date_str):
     except ValueError:
         return False, "Некорректный формат даты"
 
+# choose.html считает начало беременности как дату месячных или зачатия + 14 дней,
+# поэтому при свежей дате начало ещё впереди, а срок получается отрицательным
+START_DATE_AHEAD_DAYS = 14
+START_DATE_BACK_WEEKS = 45
+
+def validate_start_date(date_str):
+    """Валидация даты начала беременности: до 45 недель назад и до 14 дней вперёд"""
+    if not date_str:
+        return False, "Не указана дата начала беременности"
+    try:
+        parsed_date = datetime.fromisoformat(date_str).date()
+    except ValueError:
+        return False, "Некорректный формат даты"
+    days = (parsed_date - date.today()).days
+    if days > START_DATE_AHEAD_DAYS:
+        return False, f"Дата начала беременности не может быть позже чем через {START_DATE_AHEAD_DAYS} дней"
+    if days < -START_DATE_BACK_WEEKS * 7:
+        return False, f"Дата начала беременности не может быть раньше чем {START_DATE_BACK_WEEKS} недель назад"
+    return True, None
+
+def validate_current_weeks(weeks):
+    """Валидация текущего срока из choose.html: отрицательный, пока начало впереди"""
+    try:
+        weeks_int = int(weeks)
+        min_weeks = -(START_DATE_AHEAD_DAYS // 7)
+        if weeks_int < min_weeks or weeks_int > START_DATE_BACK_WEEKS:
+            return False, f"Срок беременности должен быть от {min_weeks} до {START_DATE_BACK_WEEKS} недель"
+        return True, None
+    except (ValueError, TypeError):
+        return False, "Некорректный формат недель"
+
 def validate_weeks(weeks):
     """Валидация недель беременности"""
     try:
@@ -82,14 +133,180 @@ def validate_weeks(weeks):
     except (ValueError, TypeError):
         return False, "Некорректный формат недель"
 
+def validate_score(score):
+    """Валидация оценки настроения или самочувствия (1–3)"""
+    if score is None:
+        return False, "Не указана оценка"
+    try:
+        score_int = int(score)
+        if score_int < 1 or score_int > 3:
+            return False, "Оценка должна быть от 1 до 3"
+        return True, None
+    except (ValueError, TypeError):
+        return False, "Некорректный формат оценки"
+
+def validate_sugar(sugar):
+    """Валидация уровня сахара"""
+    if sugar is None:
+        return False, "Не указан сахар"
+    try:
+        sugar_float = float(sugar)
+        if sugar_float < 1 or sugar_float > 35:
+            return False, "Сахар должен быть от 1 до 35 ммоль/л"
+        return True, None
+    except (ValueError, TypeError):
+        return False, "Некорректный формат сахара"
+
+# Схемы тел запросов на запись: собираются один раз, проверяются до соединения с БД
+_NUMBER = (int, float, str)
+USER_ID_FIELD = schemas.Field(validate_user_id, str, types=(str, int))
+# Дата измерения; для даты начала беременности — validate_start_date
+DATE_FIELD = schemas.Field(validate_date, types=(str,))
+
+REGISTER_SCHEMA = schemas.compile_schema({
+    "user_id": USER_ID_FIELD,
+    "username": schemas.Field(types=(str,), required=False, default=""),
+})
+HEIGHT_SCHEMA = schemas.compile_schema({
+    "user_id": USER_ID_FIELD,
+    "height": schemas.Field(validate_height, int, types=_NUMBER),
+})
+WEEKS_SCHEMA = schemas.compile_schema({
+    "user_id": USER_ID_FIELD,
+    "start_date": schemas.Field(validate_start_date, types=(str,)),
+    "weeks": schemas.Field(validate_current_weeks, int, types=_NUMBER),
+})
+NORMAL_PRESSURE_SCHEMA = schemas.compile_schema({
+    "user_id": USER_ID_FIELD,
+    "systolic": schemas.Field(convert=int, types=_NUMBER),
+    "diastolic": schemas.Field(convert=int, types=_NUMBER),
+}, rules=[(("systolic", "diastolic"), validate_pressure)])
+PRESSURE_SCHEMA = schemas.compile_schema({
+    "user_id": USER_ID_FIELD,
+    "date": DATE_FIELD,
+    "systolic": schemas.Field(convert=int, types=_NUMBER),
+    "diastolic": schemas.Field(convert=int, types=_NUMBER),
+}, rules=[(("systolic", "diastolic"), validate_pressure)])
+MOOD_SCHEMA = schemas.compile_schema({
+    "user_id": USER_ID_FIELD,
+    "date": DATE_FIELD,
+    "mood": schemas.Field(validate_score, int, types=_NUMBER),
+    "wellbeing": schemas.Field(validate_score, int, types=_NUMBER),
+})
+SUGAR_SCHEMA = schemas.compile_schema({
+    "user_id": USER_ID_FIELD,
+    "date": DATE_FIELD,
+    "sugar": schemas.Field(validate_sugar, float, types=_NUMBER),
+})
+WEIGHT_SCHEMA = schemas.compile_schema({
+    "user_id": USER_ID_FIELD,
+    "date": DATE_FIELD,
+    "weight": schemas.Field(validate_weight, float, types=_NUMBER),
+})
+
+def require_admin(view):
+    """Доступ только с токеном из ADMIN_TOKEN (заголовок X-Admin-Token или ?token=)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        admin_token = os.environ.get("ADMIN_TOKEN")
+        token = request.headers.get("X-Admin-Token") or request.args.get("token")
+        if not admin_token or token != admin_token:
+            return jsonify({"error": "Доступ запрещён"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+def require_clinician(view):
+    """Доступ врача: токен из CLINICIAN_TOKEN (заголовок X-Clinician-Token) или админский"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        tokens = {os.environ.get("CLINICIAN_TOKEN"), os.environ.get("ADMIN_TOKEN")} - {None, ""}
+        token = (request.headers.get("X-Clinician-Token") or request.headers.get("X-Admin-Token")
+                 or request.args.get("token"))
+        if not token or token not in tokens:
+            return jsonify({"error": "Доступ запрещён"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.during_backup = backup.is_running()
+
+@app.after_request
+def record_request_time(response):
+    started = g.get("request_started")
+    if started is not None:
+        request_stats.record(
+            (time.perf_counter() - started) * 1000,
+            during_backup=g.during_backup or backup.is_running()
+        )
+    return response
+
+@app.before_request
+def start_memory_tracking():
+    memory_guard.before_request()
+
+@app.after_request
+def record_memory_usage(response):
+    return memory_guard.after_request(response)
+
+@app.teardown_request
+def finish_memory_tracking(error):
+    memory_guard.teardown_request(error)
+
+@app.before_request
+def start_traffic_capture():
+    traffic_capture.before_request()
+
+@app.after_request
+def record_traffic(response):
+    return traffic_capture.after_request(response)
+
+@app.before_request
+def check_rate_limit():
+    return rate_limit.before_request()
+
+@app.errorhandler(memory_guard.ResponseTooLarge)
+def response_too_large(error):
+    return memory_guard.too_large_response(error)
+
+@app.errorhandler(admission.Overloaded)
+def overloaded(error):
+    return admission.overloaded_response(error)
+
 @app.route("/")
 def welcome():
-    return render_template("welcome.html")
+    return page_cache.serve_page("welcome.html")
 
 @app.route("/health")
 def health():
     return jsonify({"status": "ok", "message": "Flask app is running"})
 
+def start_reply(data, host):
+    """Ответ на /start с кнопкой Web App; None, если отвечать не нужно"""
+    message = data.get('message', {})
+    chat_id = message.get('chat', {}).get('id')
+    text = message.get('text', '')
+
+    if text != '/start':
+        return None
+
+    webapp_url = f"https://{host}/"
+    keyboard = {
+        "inline_keyboard": [[
+            {
+                "text": "🚀 Открыть приложение",
+                "web_app": {"url": webapp_url}
+            }
+        ]]
+    }
+    return {
+        'chat_id': chat_id,
+        'text': '🤰 <b>Добро пожаловать в Ассистент беременности!</b>\n\nЭто приложение поможет вам отслеживать все важные показатели во время беременности.\n\nНажмите кнопку ниже, чтобы открыть приложение:',
+        'parse_mode': 'HTML',
+        'reply_markup': keyboard
+    }
+
 @app.route("/webhook", methods=["POST"])
 def telegram_webhook():
     """Обработчик webhook от Telegram"""
@@ -99,32 +316,10 @@ def telegram_webhook():
         if not data:
             return jsonify({"status": "ok"})
         
-        message = data.get('message', {})
-        chat_id = message.get('chat', {}).get('id')
-        text = message.get('text', '')
-        
-        if text == '/start':
-            # Отправляем приветственное сообщение с кнопкой Web App
-            webapp_url = f"https://{request.host}/"
-            
-            keyboard = {
-                "inline_keyboard": [[
-                    {
-                        "text": "🚀 Открыть приложение",
-                        "web_app": {"url": webapp_url}
-                    }
-                ]]
-            }
-            
-            url = f"https://api.telegram.org/bot{os.environ.get('TELEGRAM_BOT_TOKEN')}/sendMessage"
-            payload = {
-                'chat_id': chat_id,
-                'text': '🤰 <b>Добро пожаловать в Ассистент беременности!</b>\n\nЭто приложение поможет вам отслеживать все важные показатели во время беременности.\n\nНажмите кнопку ниже, чтобы открыть приложение:',
-                'parse_mode': 'HTML',
-                'reply_markup': keyboard
-            }
-            
-            requests.post(url, json=payload)
+        payload = start_reply(data, request.host)
+        if payload:
+            # Отправка в фоне: обработчик не ждёт Telegram
+            async_runtime.post_nowait(async_runtime.telegram_url("sendMessage"), json=payload)
         
         return jsonify({"status": "ok"})
         
@@ -280,173 +475,346 @@ def test_page():
 
 @app.route("/choose")
 def choose():
-    return render_template("choose.html")
+    return page_cache.serve_page("choose.html")
 
 @app.route("/main")
 def main():
-    return render_template("index.html")
+    return page_cache.serve_page("index.html")
 
 @app.route("/weight")
 def weight():
-    return render_template("weight.html")
+    return page_cache.serve_page("weight.html")
 
 @app.route("/register_user", methods=["POST"])
-def register_user():
-    data = request.json
-    user_id = data.get("user_id")
-    username = data.get("username", "")
-
-    conn = sqlite3.connect("pregnancy.db")
+@schemas.validate(REGISTER_SCHEMA)
+@admission.limit("write")
+def register_user(entries):
+    conn = admission.connect()
     cursor = conn.cursor()
-    cursor.execute("""
+    cursor.executemany("""
         INSERT OR IGNORE INTO users (user_id, username)
         VALUES (?, ?)
-    """, (user_id, username))
+    """, [(entry["user_id"], entry["username"]) for entry in entries])
     conn.commit()
     conn.close()
 
-    return jsonify({"status": "ok"})
+    return jsonify({"status": "ok", "saved": len(entries)})
 
 @app.route("/save_height", methods=["POST"])
-def save_height():
+@schemas.validate(HEIGHT_SCHEMA)
+@admission.limit("write")
+def save_height(entries):
     try:
-        data = request.json
-        user_id = data.get("user_id")
-        height = data.get("height")
-
-        # Валидация данных
-        is_valid, error_msg = validate_user_id(user_id)
-        if not is_valid:
-            return jsonify({"error": error_msg}), 400
-
-        is_valid, error_msg = validate_height(height)
-        if not is_valid:
-            return jsonify({"error": error_msg}), 400
-
-        conn = sqlite3.connect("pregnancy.db")
+        conn = admission.connect()
         cursor = conn.cursor()
-        cursor.execute("""
+        cursor.executemany("""
             INSERT OR REPLACE INTO user_height (user_id, height)
             VALUES (?, ?)
-        """, (user_id, height))
+        """, [(entry["user_id"], entry["height"]) for entry in entries])
+        for user_id in {entry["user_id"] for entry in entries}:
+            invalidate_weight_summary(cursor, user_id)
         conn.commit()
         conn.close()
+        for entry in entries:
+            live_events.publish(entry["user_id"], "height", {"height": entry["height"]})
 
-        return jsonify({"status": "ok"})
+        return jsonify({"status": "ok", "saved": len(entries)})
     except Exception as e:
+        admission.raise_if_locked(e)
         print(f"Ошибка в save_height: {e}")
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
 
+def read_user_profile(cursor, user_id):
+    """Профиль, нормы и статус за сегодня — общая часть /load_user_data и /bootstrap.
+
+    Недели, триместр и нормы веса берутся из предвычисленных pregnancy_weeks и
+    weight_summary (ночное задание batch_jobs), если они посчитаны сегодня.
+    Возвращает (профиль, True если нормы пришлось посчитать заново).
+    """
+    today = date.today().isoformat()
+
+    # Получаем все записи веса для пользователя
+    cursor.execute("SELECT weight, date FROM weights WHERE user_id = ? ORDER BY date ASC", (user_id,))
+    weight_rows = memory_guard.fetch_limited(cursor)
+    start_weight = weight_rows[0][0] if weight_rows else None
+
+    # Дата начала, рост и предвычисленные поля одним запросом
+    cursor.execute("""
+        SELECT ps.start_date, h.height,
+               pw.weeks, pw.trimester, pw.computed_on,
+               ws.bmi, ws.bmi_category, ws.min_kg, ws.max_kg, ws.computed_on
+        FROM (SELECT ? AS user_id) u
+        LEFT JOIN pregnancy_start ps ON ps.user_id = u.user_id
+        LEFT JOIN user_height h ON h.user_id = u.user_id
+        LEFT JOIN pregnancy_weeks pw ON pw.user_id = u.user_id
+        LEFT JOIN weight_summary ws ON ws.user_id = u.user_id
+    """, (user_id,))
+    (start_date, height, pre_weeks, pre_trimester, weeks_computed_on,
+     bmi, bmi_category, min_kg, max_kg, summary_computed_on) = cursor.fetchone()
+
+    # Текущая неделя беременности: из ночного пересчёта или на лету
+    weeks = None
+    current_trimester = None
+    if start_date and weeks_computed_on == today:
+        weeks = pre_weeks
+        current_trimester = pre_trimester
+    elif start_date:
+        try:
+            weeks = pregnancy_week(start_date)
+        except Exception as e:
+            print(f"Ошибка при вычислении недель: {e}")
+            weeks = None
+        current_trimester = trimester(weeks)
+
+    # Нормы прибавки веса
+    norm_info = None
+    norm_computed = False
+    if summary_computed_on == today and bmi is not None:
+        norm_info = {"bmi": bmi, "category": bmi_category, "min_kg": min_kg, "max_kg": max_kg}
+    elif start_weight and height and weeks is not None:
+        norm_info = calculate_weight_norm(weeks, height, start_weight)
+        norm_computed = norm_info is not None
+
+    # Проверяем, есть ли записи на сегодня
+    cursor.execute("SELECT COUNT(*) FROM weights WHERE user_id = ? AND date = ?", (user_id, today))
+    has_weight_today = cursor.fetchone()[0] > 0
+
+    cursor.execute("SELECT COUNT(*) FROM pressure_entries WHERE user_id = ? AND date = ?", (user_id, today))
+    has_pressure_today = cursor.fetchone()[0] > 0
+
+    cursor.execute("SELECT COUNT(*) FROM mood_entries WHERE user_id = ? AND date = ?", (user_id, today))
+    has_mood_today = cursor.fetchone()[0] > 0
+
+    cursor.execute("SELECT COUNT(*) FROM sugar_entries WHERE user_id = ? AND date = ?", (user_id, today))
+    has_sugar_today = cursor.fetchone()[0] > 0
+
+    return {
+        "start_weight": start_weight,
+        "weights": weight_rows,
+        "weeks": weeks,
+        "trimester": current_trimester,
+        "start_date": start_date,
+        "height": height,
+        "norm_info": norm_info,
+        "status": {
+            "weight_today": has_weight_today,
+            "pressure_today": has_pressure_today,
+            "mood_today": has_mood_today,
+            "sugar_today": has_sugar_today
+        }
+    }, norm_computed
+
+def read_weight_history(cursor, user_id):
+    cursor.execute("""
+        SELECT date, weight FROM weights
+        WHERE user_id = ?
+        ORDER BY date ASC
+    """, (user_id,))
+    return memory_guard.fetch_limited(cursor)
+
+def read_pressure_history(cursor, user_id):
+    cursor.execute("SELECT systolic, diastolic FROM normal_pressure WHERE user_id = ?", (user_id,))
+    norm_row = cursor.fetchone()
+    norm_pressure = {"systolic": norm_row[0], "diastolic": norm_row[1]} if norm_row else None
+
+    cursor.execute("""
+        SELECT date, systolic, diastolic
+        FROM pressure_entries
+        WHERE user_id = ?
+        ORDER BY date ASC
+    """, (user_id,))
+    entries = memory_guard.fetch_limited(cursor)
+
+    return norm_pressure, entries, pressure_alerts.load_alert_state(cursor, user_id)
+
+def read_mood_history(cursor, user_id):
+    cursor.execute("""
+        SELECT date, mood, wellbeing
+        FROM mood_entries
+        WHERE user_id = ?
+        ORDER BY date
+    """, (user_id,))
+    return memory_guard.fetch_limited(cursor)
+
+def read_sugar_history(cursor, user_id):
+    cursor.execute("""
+        SELECT date, sugar FROM sugar_entries
+        WHERE user_id = ?
+        ORDER BY date
+    """, (user_id,))
+    return memory_guard.fetch_limited(cursor)
+
+def invalidate_weight_summary(cursor, user_id):
+    """Сбрасывает предвычисленные нормы после изменения веса, роста или срока"""
+    cursor.execute("UPDATE weight_summary SET computed_on = NULL WHERE user_id = ?", (user_id,))
+
 @app.route("/load_user_data", methods=["GET"])
+@admission.limit("read")
 def load_user_data():
     user_id = request.args.get("user_id")
     if not user_id:
         return jsonify({"error": "Не указан user_id"}), 400
     
-    conn = sqlite3.connect("pregnancy.db")
+    conn = admission.connect()
     cursor = conn.cursor()
     
     try:
-        # Получаем все записи веса для пользователя
-        cursor.execute("SELECT weight, date FROM weights WHERE user_id = ? ORDER BY date ASC", (user_id,))
-        weight_rows = cursor.fetchall()
-        start_weight = weight_rows[0][0] if weight_rows else None
-
-        # Получаем дату начала беременности
-        cursor.execute("SELECT start_date FROM pregnancy_start WHERE user_id = ?", (user_id,))
-        row = cursor.fetchone()
-        start_date = row[0] if row else None
-
-        # Вычисляем текущую неделю беременности
-        weeks = None
-        if start_date:
-            try:
-                from datetime import date
-                start_date_obj = date.fromisoformat(start_date)
-                diff_days = (date.today() - start_date_obj).days
-                weeks = max(0, diff_days // 7)  # Не может быть отрицательной
-            except Exception as e:
-                print(f"Ошибка при вычислении недель: {e}")
-                weeks = None
-
-        # Получаем рост пользователя
-        cursor.execute("SELECT height FROM user_height WHERE user_id = ?", (user_id,))
-        row = cursor.fetchone()
-        height = row[0] if row else None
-
-        # Вычисляем нормы прибавки веса
-        norm_info = None
-        if start_weight and height and weeks is not None:
-            norm_info = calculate_weight_norm(weeks, height, start_weight)
-            if norm_info:
-                cursor.execute("""
-                    INSERT OR REPLACE INTO weight_summary (user_id, bmi, bmi_category, min_kg, max_kg)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (
-                    user_id,
-                    norm_info["bmi"],
-                    norm_info["category"],
-                    norm_info["min_kg"],
-                    norm_info["max_kg"]
-                ))
-
-        # Получаем последние записи для индикаторов статуса
-        today = date.today().isoformat()
-        
-        # Проверяем, есть ли записи на сегодня
-        cursor.execute("SELECT COUNT(*) FROM weights WHERE user_id = ? AND date = ?", (user_id, today))
-        has_weight_today = cursor.fetchone()[0] > 0
-        
-        cursor.execute("SELECT COUNT(*) FROM pressure_entries WHERE user_id = ? AND date = ?", (user_id, today))
-        has_pressure_today = cursor.fetchone()[0] > 0
-        
-        cursor.execute("SELECT COUNT(*) FROM mood_entries WHERE user_id = ? AND date = ?", (user_id, today))
-        has_mood_today = cursor.fetchone()[0] > 0
-        
-        cursor.execute("SELECT COUNT(*) FROM sugar_entries WHERE user_id = ? AND date = ?", (user_id, today))
-        has_sugar_today = cursor.fetchone()[0] > 0
+        profile, norm_computed = read_user_profile(cursor, user_id)
+
+        # Сохраняем посчитанные нормы до следующего ночного пересчёта
+        norm_info = profile["norm_info"]
+        if norm_computed:
+            cursor.execute("""
+                INSERT OR REPLACE INTO weight_summary (user_id, bmi, bmi_category, min_kg, max_kg, weeks, computed_on)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (
+                user_id,
+                norm_info["bmi"],
+                norm_info["category"],
+                norm_info["min_kg"],
+                norm_info["max_kg"],
+                profile["weeks"],
+                date.today().isoformat()
+            ))
 
         conn.commit()
         
-        return jsonify({
-            "start_weight": start_weight,
-            "weights": weight_rows,
-            "weeks": weeks,
-            "start_date": start_date,
-            "height": height,
-            "norm_info": norm_info,
-            "status": {
-                "weight_today": has_weight_today,
-                "pressure_today": has_pressure_today,
-                "mood_today": has_mood_today,
-                "sugar_today": has_sugar_today
-            }
-        })
+        return jsonify(profile)
         
+    except memory_guard.ResponseTooLarge:
+        raise
     except Exception as e:
+        admission.raise_if_locked(e)
         print(f"Ошибка в load_user_data: {e}")
         return jsonify({"error": "Ошибка загрузки данных"}), 500
     finally:
         conn.close()
 
+# Истории, которые можно запросить через /bootstrap?include=...
+BOOTSTRAP_SECTIONS = ("weights", "pressure", "mood", "sugar")
+
+@app.route("/bootstrap", methods=["GET"])
+@admission.limit("read")
+def bootstrap():
+    """Профиль и запрошенные истории одним ответом из одного снимка БД"""
+    user_id = request.args.get("user_id")
+    if not user_id:
+        return jsonify({"error": "Не указан user_id"}), 400
+
+    include = [part for part in request.args.get("include", "").split(",") if part]
+    unknown = [part for part in include if part not in BOOTSTRAP_SECTIONS]
+    if unknown:
+        return jsonify({"error": f"Неизвестные разделы: {', '.join(unknown)}"}), 400
+
+    conn = admission.connect()
+    cursor = conn.cursor()
+
+    try:
+        # Все чтения в одной транзакции — согласованный снимок
+        cursor.execute("BEGIN")
+        result = {"user": read_user_profile(cursor, user_id)[0]}
+
+        if "weights" in include:
+            result["weights"] = wire_format.encode_rows(read_weight_history(cursor, user_id), ["weight"])
+        if "pressure" in include:
+            norm_pressure, entries, alerts = read_pressure_history(cursor, user_id)
+            result["pressure"] = {
+                "normal_pressure": norm_pressure,
+                "entries": wire_format.encode_rows(entries, ["systolic", "diastolic"]),
+                "alerts": alerts
+            }
+        if "mood" in include:
+            result["mood"] = {"entries": wire_format.encode_rows(read_mood_history(cursor, user_id), ["mood", "wellbeing"])}
+        if "sugar" in include:
+            result["sugar"] = {"entries": wire_format.encode_rows(read_sugar_history(cursor, user_id), ["sugar"])}
+
+        conn.rollback()
+        return wire_format.json_response(result)
+
+    except memory_guard.ResponseTooLarge:
+        raise
+    except Exception as e:
+        admission.raise_if_locked(e)
+        print(f"Ошибка в bootstrap: {e}")
+        return jsonify({"error": "Ошибка загрузки данных"}), 500
+    finally:
+        conn.close()
+
 
 # 🔽 ДОБАВЛЕНО: получение всех записей веса
 @app.route("/get_weights", methods=["GET"])
+@admission.limit("read")
 def get_weights():
     user_id = request.args.get("user_id", "default")
-    conn = sqlite3.connect("pregnancy.db")
+    conn = admission.connect()
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT date, weight FROM weights
-        WHERE user_id = ?
-        ORDER BY date ASC
-    """, (user_id,))
-    rows = cursor.fetchall()
+    rows = read_weight_history(cursor, user_id)
     conn.close()
 
-    return jsonify(rows)
+    return wire_format.json_response(wire_format.encode_rows(rows, ["weight"]))
+
+@app.route("/admin/backup", methods=["GET", "POST"])
+@require_admin
+def admin_backup():
+    """Статус резервного копирования; POST запускает копию в фоне"""
+    if request.method == "POST":
+        if backup.is_running():
+            return jsonify({"status": "running"}), 409
+        threading.Thread(target=backup.create_backup, name="backup-manual", daemon=True).start()
+        return jsonify({"status": "started"}), 202
+
+    return jsonify({
+        "running": backup.is_running(),
+        "last_backup": backup.last_backup or None,
+        "backups": [os.path.basename(path) for path in backup.list_backups()],
+        "request_latency": request_stats.summary()
+    })
+
+@app.route("/admin/memory", methods=["GET", "POST"])
+@require_admin
+def admin_memory():
+    """Память по маршрутам; POST {"tracemalloc": true/false, "reset": true} управляет сбором"""
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        if "tracemalloc" in data:
+            memory_guard.set_tracing(bool(data["tracemalloc"]))
+        if data.get("reset"):
+            memory_guard.reset()
+    return jsonify(memory_guard.report())
+
+@app.route("/admin/admission")
+@require_admin
+def admin_admission():
+    """Очередь к БД: активные и ждущие запросы, отказы по причинам"""
+    return jsonify(admission.report())
+
+@app.route("/admin/rate_limit")
+@require_admin
+def admin_rate_limit():
+    """Пропущенные и отклонённые лимитером запросы этого воркера"""
+    return jsonify(rate_limit.report())
+
+@app.route("/admin/capture", methods=["GET", "POST"])
+@require_admin
+def admin_capture():
+    """Запись трафика для replay.py: POST {"enabled": true, "path": "traffic.jsonl.gz"}"""
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        if data.get("enabled"):
+            traffic_capture.start(data.get("path") or traffic_capture.CAPTURE_PATH or "traffic.jsonl.gz",
+                                  traffic_capture.CAPTURE_KEY)
+        elif "enabled" in data:
+            traffic_capture.stop()
+    return jsonify(traffic_capture.status())
+
+@app.route("/admin/events")
+@require_admin
+def admin_events():
+    """Подписчики потока /events в этом воркере"""
+    return jsonify(live_events.report())
 
 @app.route("/debug_all")
+@admission.limit("read")
 def debug_all():
     import datetime
     import traceback
@@ -457,7 +825,7 @@ def debug_all():
     result = {}
 
     try:
-        conn = sqlite3.connect("pregnancy.db")
+        conn = admission.connect()
         cursor = conn.cursor()
 
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
@@ -466,7 +834,7 @@ def debug_all():
 
         if "users" in tables:
             cursor.execute("SELECT * FROM users")
-            rows = cursor.fetchall()
+            rows = memory_guard.fetch_limited(cursor)
             print("Пользователи:", rows)
             result["users"] = [convert(row) for row in rows]
         else:
@@ -474,7 +842,7 @@ def debug_all():
 
         if "weights" in tables:
             cursor.execute("SELECT * FROM weights")
-            rows = cursor.fetchall()
+            rows = memory_guard.fetch_limited(cursor)
             print("Вес:", rows)
             result["weights"] = [convert(row) for row in rows]
         else:
@@ -482,7 +850,7 @@ def debug_all():
 
         if "pregnancy_weeks" in tables:
             cursor.execute("SELECT * FROM pregnancy_weeks")
-            rows = cursor.fetchall()
+            rows = memory_guard.fetch_limited(cursor)
             print("Сроки:", rows)
             result["pregnancy_weeks"] = [convert(row) for row in rows]
         else:
@@ -490,7 +858,7 @@ def debug_all():
 
         if "weight_summary" in tables:
             cursor.execute("SELECT * FROM weight_summary")
-            rows = cursor.fetchall()
+            rows = memory_guard.fetch_limited(cursor)
             print("Индекс и норма:", rows)
             result["weight_summary"] = [convert(row) for row in rows]
         else:
@@ -498,7 +866,7 @@ def debug_all():
 
         if "normal_pressure" in tables:
             cursor.execute("SELECT * FROM normal_pressure")
-            rows = cursor.fetchall()
+            rows = memory_guard.fetch_limited(cursor)
             print("Нормальное давление:", rows)
             result["normal_pressure"] = [convert(row) for row in rows]
         else:
@@ -506,7 +874,7 @@ def debug_all():
 
         if "pressure_entries" in tables:
             cursor.execute("SELECT * FROM pressure_entries")
-            rows = cursor.fetchall()
+            rows = memory_guard.fetch_limited(cursor)
             print("Записи давления:", rows)
             result["pressure_entries"] = [convert(row) for row in rows]
         else:
@@ -515,59 +883,56 @@ def debug_all():
         conn.close()
         return jsonify(result)
 
+    except memory_guard.ResponseTooLarge:
+        raise
     except Exception as e:
+        admission.raise_if_locked(e)
         print("ОШИБКА В /debug_all:")
         traceback.print_exc()
         return f"<pre>Ошибка: {str(e)}</pre>", 500
 
 # After: main.py (save_weeks storing start_date and weeks)
 @app.route("/save_weeks", methods=["POST"])
-def save_weeks():
-        data = request.json
-        user_id = data.get("user_id")
-        weeks = data.get("weeks")
-        start_date = data.get("start_date")  # New field for pregnancy start date
-        if not user_id or start_date is None or weeks is None:
-            return jsonify({"error": "Недостаточно данных"}), 400
-        conn = sqlite3.connect("pregnancy.db")
-        cursor = conn.cursor()
-        # Ensure tables exist
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS pregnancy_start (
-                user_id TEXT PRIMARY KEY,
-                start_date TEXT
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS pregnancy_weeks (
-                user_id TEXT PRIMARY KEY,
-                weeks INTEGER
-            )
-        """)
-        # Save/Update pregnancy start date and weeks in the database
-        cursor.execute("""
-            INSERT OR REPLACE INTO pregnancy_start (user_id, start_date)
-            VALUES (?, ?)
-        """, (user_id, start_date))
-        cursor.execute("""
-            INSERT OR REPLACE INTO pregnancy_weeks (user_id, weeks)
-            VALUES (?, ?)
-        """, (user_id, weeks))
-        conn.commit()
-        conn.close()
-        return jsonify({"status": "ok"})
+@schemas.validate(WEEKS_SCHEMA)
+@admission.limit("write")
+def save_weeks(entries):
+    conn = admission.connect()
+    cursor = conn.cursor()
+    # Ensure tables exist
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pregnancy_start (
+            user_id TEXT PRIMARY KEY,
+            start_date TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pregnancy_weeks (
+            user_id TEXT PRIMARY KEY,
+            weeks INTEGER
+        )
+    """)
+    # Save/Update pregnancy start date and weeks in the database
+    cursor.executemany("""
+        INSERT OR REPLACE INTO pregnancy_start (user_id, start_date)
+        VALUES (?, ?)
+    """, [(entry["user_id"], entry["start_date"]) for entry in entries])
+    cursor.executemany("""
+        INSERT OR REPLACE INTO pregnancy_weeks (user_id, weeks)
+        VALUES (?, ?)
+    """, [(entry["user_id"], entry["weeks"]) for entry in entries])
+    for user_id in {entry["user_id"] for entry in entries}:
+        invalidate_weight_summary(cursor, user_id)
+    conn.commit()
+    conn.close()
+    for entry in entries:
+        live_events.publish(entry["user_id"], "weeks", {"weeks": entry["weeks"], "start_date": entry["start_date"]})
+    return jsonify({"status": "ok", "saved": len(entries)})
 
 @app.route("/save_normal_pressure", methods=["POST"])
-def save_normal_pressure():
-    data = request.json
-    user_id = data.get("user_id")
-    systolic = data.get("systolic")
-    diastolic = data.get("diastolic")
-
-    if not user_id or not systolic or not diastolic:
-        return jsonify({"error": "Недостаточно данных"}), 400
-
-    conn = sqlite3.connect("pregnancy.db")
+@schemas.validate(NORMAL_PRESSURE_SCHEMA)
+@admission.limit("write")
+def save_normal_pressure(entries):
+    conn = admission.connect()
     cur = conn.cursor()
     cur.execute("""
         CREATE TABLE IF NOT EXISTS normal_pressure (
@@ -576,141 +941,244 @@ def save_normal_pressure():
             diastolic INTEGER
         )
     """)
-    cur.execute("""
+    cur.executemany("""
         INSERT OR REPLACE INTO normal_pressure (user_id, systolic, diastolic)
         VALUES (?, ?, ?)
-    """, (user_id, systolic, diastolic))
+    """, [(entry["user_id"], entry["systolic"], entry["diastolic"]) for entry in entries])
     conn.commit()
     conn.close()
+    for entry in entries:
+        live_events.publish(entry["user_id"], "normal_pressure",
+                            {"systolic": entry["systolic"], "diastolic": entry["diastolic"]})
 
-    return jsonify({"status": "ok"})
+    return jsonify({"status": "ok", "saved": len(entries)})
 
 @app.route("/tests")
 def tests():
-    return render_template("tests.html")
+    return page_cache.serve_page("tests.html")
 
 @app.route("/save_pressure", methods=["POST"])
-def save_pressure():
+@schemas.validate(PRESSURE_SCHEMA)
+@admission.limit("write")
+def save_pressure(entries):
     try:
-        data = request.json
-        user_id = data.get("user_id")
-        systolic = data.get("systolic")
-        diastolic = data.get("diastolic")
-        date_str = data.get("date")
-
-        # Валидация данных
-        is_valid, error_msg = validate_user_id(user_id)
-        if not is_valid:
-            return jsonify({"error": error_msg}), 400
-
-        is_valid, error_msg = validate_pressure(systolic, diastolic)
-        if not is_valid:
-            return jsonify({"error": error_msg}), 400
-
-        is_valid, error_msg = validate_date(date_str)
-        if not is_valid:
-            return jsonify({"error": error_msg}), 400
-
-        conn = sqlite3.connect("pregnancy.db")
+        # Алерты обновляются инкрементально — измерения пакета идут по порядку дат
+        entries.sort(key=lambda entry: entry["date"])
+        conn = admission.connect()
         cur = conn.cursor()
-        cur.execute("""
-            INSERT OR REPLACE INTO pressure_entries (user_id, date, systolic, diastolic)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, date_str, systolic, diastolic))
+        alert_queued = False
+        for entry in entries:
+            cur.execute("""
+                INSERT OR REPLACE INTO pressure_entries (user_id, date, systolic, diastolic)
+                VALUES (?, ?, ?, ?)
+            """, (entry["user_id"], entry["date"], entry["systolic"], entry["diastolic"]))
+            # Инкрементальное обновление алертов в той же транзакции
+            if pressure_alerts.update_alert_state(cur, entry["user_id"], entry["date"],
+                                                  entry["systolic"], entry["diastolic"]):
+                alert_queued = True
         conn.commit()
         conn.close()
+        for entry in entries:
+            live_events.publish(entry["user_id"], "pressure", {
+                "date": entry["date"], "systolic": entry["systolic"], "diastolic": entry["diastolic"]
+            })
 
-        return jsonify({"status": "ok"})
+        if alert_queued:
+            pressure_alerts.flush_notifications_async()
+
+        return jsonify({"status": "ok", "saved": len(entries)})
     except Exception as e:
+        admission.raise_if_locked(e)
         print(f"Ошибка в save_pressure: {e}")
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
 
 @app.route("/load_pressure_data", methods=["GET"])
+@admission.limit("read")
 def load_pressure_data():
     user_id = request.args.get("user_id")
 
-    conn = sqlite3.connect("pregnancy.db")
+    conn = admission.connect()
     cur = conn.cursor()
-
-    cur.execute("SELECT systolic, diastolic FROM normal_pressure WHERE user_id = ?", (user_id,))
-    norm_row = cur.fetchone()
-    norm_pressure = {"systolic": norm_row[0], "diastolic": norm_row[1]} if norm_row else None
-
-    cur.execute("""
-        SELECT date, systolic, diastolic
-        FROM pressure_entries
-        WHERE user_id = ?
-        ORDER BY date ASC
-    """, (user_id,))
-    entries = cur.fetchall()
-
+    norm_pressure, entries, alerts = read_pressure_history(cur, user_id)
     conn.close()
 
-    return jsonify({
+    return wire_format.json_response({
         "normal_pressure": norm_pressure,
-        "entries": entries
+        "entries": wire_format.encode_rows(entries, ["systolic", "diastolic"]),
+        "alerts": alerts
     })
 
 @app.route("/pressure")
 def pressure():
-    return render_template("pressure.html")
+    return page_cache.serve_page("pressure.html")
 
 @app.route("/mood")
 def mood():
-    return render_template("mood.html")
+    return page_cache.serve_page("mood.html")
 
 @app.route("/save_mood", methods=["POST"])
-def save_mood():
-    data = request.get_json()
-    user_id = data["user_id"]
-    date = data["date"]
-    mood = data.get("mood")
-    wellbeing = data.get("wellbeing")
-
-    conn = sqlite3.connect("pregnancy.db")
+@schemas.validate(MOOD_SCHEMA)
+@admission.limit("write")
+def save_mood(entries):
+    conn = admission.connect()
     cursor = conn.cursor()
-    cursor.execute("""
+    cursor.executemany("""
         INSERT OR REPLACE INTO mood_entries (user_id, date, mood, wellbeing)
         VALUES (?, ?, ?, ?)
-    """, (user_id, date, mood, wellbeing))
+    """, [(entry["user_id"], entry["date"], entry["mood"], entry["wellbeing"]) for entry in entries])
     conn.commit()
     conn.close()
-    return jsonify({"status": "ok"})
+    for entry in entries:
+        live_events.publish(entry["user_id"], "mood", {
+            "date": entry["date"], "mood": entry["mood"], "wellbeing": entry["wellbeing"]
+        })
+    return jsonify({"status": "ok", "saved": len(entries)})
 
 @app.route("/load_mood_data")
+@admission.limit("read")
 def load_mood_data():
     user_id = request.args.get("user_id")
-    conn = sqlite3.connect("pregnancy.db")
+    conn = admission.connect()
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT date, mood, wellbeing
-        FROM mood_entries
-        WHERE user_id = ?
-        ORDER BY date
-    """, (user_id,))
-    rows = cursor.fetchall()
+    rows = read_mood_history(cursor, user_id)
+    conn.close()
+    return wire_format.json_response({"entries": wire_format.encode_rows(rows, ["mood", "wellbeing"])})
+
+@app.route("/load_weekly_data")
+@admission.limit("read")
+def load_weekly_data():
+    user_id = request.args.get("user_id")
+    metric = request.args.get("metric", "weight")
+    if not user_id:
+        return jsonify({"error": "Не указан user_id"}), 400
+    if metric not in weekly_rollups.METRICS:
+        return jsonify({"error": "Неизвестная метрика"}), 400
+
+    conn = admission.connect()
+    cursor = conn.cursor()
+    weeks = weekly_rollups.load_weekly(cursor, user_id, metric)
     conn.close()
-    return jsonify({"entries": rows})
+
+    return jsonify({"metric": metric, "weeks": weeks})
+
+@app.route("/cohort_percentiles")
+@admission.limit("read")
+def cohort_percentiles():
+    """Место пользователя среди беременных той же недели и категории ИМТ"""
+    user_id = request.args.get("user_id")
+    if not user_id:
+        return jsonify({"error": "Не указан user_id"}), 400
+
+    conn = admission.connect()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT ps.start_date, pw.weeks, pw.computed_on
+            FROM pregnancy_start ps
+            LEFT JOIN pregnancy_weeks pw ON pw.user_id = ps.user_id
+            WHERE ps.user_id = ?
+        """, (user_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return jsonify({"error": "Не указана дата начала беременности"}), 404
+        start_date, pre_weeks, computed_on = row
+
+        week = request.args.get("week")
+        if week is not None:
+            is_valid, error_msg = validate_weeks(week)
+            if not is_valid:
+                return jsonify({"error": error_msg}), 400
+            week = int(week)
+        elif computed_on == date.today().isoformat():
+            week = pre_weeks
+        else:
+            week = pregnancy_week(start_date)
+
+        return jsonify(cohorts.user_percentiles(cursor, user_id, week))
+    finally:
+        conn.close()
+
+@app.route("/clinician/overview", methods=["GET", "POST"])
+@require_clinician
+@admission.limit("read")
+def clinician_overview():
+    """Сводка по многим пациентам одним запросом, по убыванию риска.
+
+    GET ?user_ids=1,2,3&cursor=...&limit=... или POST {"user_ids": [...], "cursor": ..., "limit": ...}.
+    Без user_ids — все пациенты.
+    """
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+    else:
+        data = dict(request.args)
+        if "user_ids" in data:
+            data["user_ids"] = [part for part in data["user_ids"].split(",") if part]
+
+    user_ids = data.get("user_ids")
+    if user_ids is not None:
+        if not isinstance(user_ids, list) or len(user_ids) > clinician.MAX_USER_IDS:
+            return jsonify({"error": f"user_ids — список не длиннее {clinician.MAX_USER_IDS}"}), 400
+        for user_id in user_ids:
+            is_valid, error_msg = validate_user_id(user_id)
+            if not is_valid:
+                return jsonify({"error": f"{error_msg}: {user_id}"}), 400
+
+    try:
+        limit = int(data.get("limit", clinician.DEFAULT_PAGE_SIZE))
+        if not 1 <= limit <= clinician.MAX_PAGE_SIZE:
+            raise ValueError(limit)
+    except (ValueError, TypeError):
+        return jsonify({"error": f"limit должен быть от 1 до {clinician.MAX_PAGE_SIZE}"}), 400
+
+    cursor_token = data.get("cursor")
+    try:
+        if cursor_token:
+            clinician.decode_cursor(str(cursor_token))
+    except ValueError:
+        return jsonify({"error": "Некорректный курсор"}), 400
+
+    conn = admission.connect()
+    try:
+        page = clinician.overview(conn, date.today().isoformat(), user_ids,
+                                  str(cursor_token) if cursor_token else None, limit)
+    finally:
+        conn.close()
+    return wire_format.json_response(page)
+
+@app.route("/events")
+def events():
+    """Новые и изменённые записи пользователя потоком Server-Sent Events.
+
+    Соединение с БД не нужно, поэтому маршрут не проходит через admission;
+    число потоков ограничено live_events.MAX_SUBSCRIBERS.
+    """
+    user_id = request.args.get("user_id")
+    is_valid, error_msg = validate_user_id(user_id)
+    if not is_valid:
+        return jsonify({"error": error_msg}), 400
+
+    subscription = live_events.subscribe(user_id, request.headers.get("Last-Event-ID"))
+    response = Response(live_events.stream(subscription), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # nginx и другие прокси не должны копить поток в буфере
+        "X-Accel-Buffering": "no",
+    })
+    response.call_on_close(subscription.close)
+    return response
 
 @app.route("/monitoring")
 def monitoring():
-    return render_template("monitoring.html")
+    return page_cache.serve_page("monitoring.html")
 
 @app.route("/sugar")
 def sugar_page():
-    return render_template("sugar.html")
+    return page_cache.serve_page("sugar.html")
 
 @app.route("/save_sugar", methods=["POST"])
-def save_sugar():
-    data = request.get_json()
-    user_id = data.get("user_id")
-    date = data.get("date")
-    sugar = data.get("sugar")
-
-    if not user_id or not date or sugar is None:
-        return jsonify({"error": "Missing data"}), 400
-
-    conn = sqlite3.connect("pregnancy.db")
+@schemas.validate(SUGAR_SCHEMA)
+@admission.limit("write")
+def save_sugar(entries):
+    conn = admission.connect()
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS sugar_entries (
@@ -720,22 +1188,25 @@ def save_sugar():
             PRIMARY KEY (user_id, date)
         )
     """)
-    cursor.execute("""
+    cursor.executemany("""
         INSERT OR REPLACE INTO sugar_entries (user_id, date, sugar)
         VALUES (?, ?, ?)
-    """, (user_id, date, sugar))
+    """, [(entry["user_id"], entry["date"], entry["sugar"]) for entry in entries])
     conn.commit()
     conn.close()
+    for entry in entries:
+        live_events.publish(entry["user_id"], "sugar", {"date": entry["date"], "sugar": entry["sugar"]})
 
-    return jsonify({"status": "ok"})
+    return jsonify({"status": "ok", "saved": len(entries)})
 
 @app.route("/load_sugar_data", methods=["GET"])
+@admission.limit("read")
 def load_sugar_data():
     user_id = request.args.get("user_id")
     if not user_id:
         return jsonify({"error": "Missing user_id"}), 400
 
-    conn = sqlite3.connect("pregnancy.db")
+    conn = admission.connect()
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS sugar_entries (
@@ -745,101 +1216,47 @@ def load_sugar_data():
             PRIMARY KEY (user_id, date)
         )
     """)
-    cursor.execute("""
-        SELECT date, sugar FROM sugar_entries
-        WHERE user_id = ?
-        ORDER BY date
-    """, (user_id,))
-    rows = cursor.fetchall()
+    rows = read_sugar_history(cursor, user_id)
     conn.close()
 
-    return jsonify({"entries": rows})
+    return wire_format.json_response({"entries": wire_format.encode_rows(rows, ["sugar"])})
 
 @app.route("/save_weight", methods=["POST"])
-def save_weight():
+@schemas.validate(WEIGHT_SCHEMA)
+@admission.limit("write")
+def save_weight(entries):
     try:
-        data = request.json
-        weight = data.get("weight")
-        date_str = data.get("date")
-        user_id = data.get("user_id", "default")
-
-        # Валидация данных
-        is_valid, error_msg = validate_user_id(user_id)
-        if not is_valid:
-            return jsonify({"error": error_msg}), 400
-
-        is_valid, error_msg = validate_weight(weight)
-        if not is_valid:
-            return jsonify({"error": error_msg}), 400
-
-        is_valid, error_msg = validate_date(date_str)
-        if not is_valid:
-            return jsonify({"error": error_msg}), 400
-
-        conn = sqlite3.connect("pregnancy.db")
+        conn = admission.connect()
         cursor = conn.cursor()
 
         # Вставка или обновление записи
-        cursor.execute("""
+        cursor.executemany("""
             INSERT INTO weights (user_id, date, weight)
             VALUES (?, ?, ?)
             ON CONFLICT(user_id, date) DO UPDATE SET weight = excluded.weight
-        """, (user_id, date_str, weight))
+        """, [(entry["user_id"], entry["date"], entry["weight"]) for entry in entries])
+        for user_id in {entry["user_id"] for entry in entries}:
+            invalidate_weight_summary(cursor, user_id)
 
         conn.commit()
         conn.close()
+        for entry in entries:
+            live_events.publish(entry["user_id"], "weight", {"date": entry["date"], "weight": entry["weight"]})
 
-        return jsonify({"status": "ok"})
+        return jsonify({"status": "ok", "saved": len(entries)})
     except Exception as e:
+        admission.raise_if_locked(e)
         print(f"Ошибка в save_weight: {e}")
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
 
-def calculate_weight_norm(week, height_cm, start_weight):
-    if not week or not height_cm or not start_weight:
-        return None
-
-    height_m = height_cm / 100
-    bmi = start_weight / (height_m ** 2)
-
-    if bmi < 18.5:
-        category = "underweight"
-        base_gain = 1.2
-    elif 18.5 <= bmi < 25:
-        category = "normal"
-        base_gain = 1.0
-    elif 25 <= bmi < 30:
-        category = "overweight"
-        base_gain = 0.7
-    else:
-        category = "obese"
-        base_gain = 0.5
-
-    # Первая прибавка появляется после 8-й недели
-    if week < 9:
-        return {
-            "bmi": round(bmi, 1),
-            "category": category,
-            "min_kg": 0,
-            "max_kg": 0
-        }
-
-    # Мосгорздрав: прирост массы тела после 8-й недели
-    weeks_with_gain = week - 8
-    min_kg = weeks_with_gain * (base_gain - 0.2)
-    max_kg = weeks_with_gain * (base_gain + 0.2)
-
-    return {
-        "bmi": round(bmi, 1),
-        "category": category,
-        "min_kg": round(min_kg, 1),
-        "max_kg": round(max_kg, 1)
-    }
-
 # ▶️ Создание всех необходимых таблиц при старте
 def init_tables():
         conn = sqlite3.connect("pregnancy.db")
         cursor = conn.cursor()
 
+        # WAL: читатели (в том числе резервное копирование) не блокируют запись
+        cursor.execute("PRAGMA journal_mode=WAL")
+
         # Таблица пользователей
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS users (
@@ -946,12 +1363,22 @@ def init_tables():
             )
         """)
 
+        # Состояние алертов давления и очередь уведомлений
+        pressure_alerts.init_alert_tables(cursor)
+
+        # Недельные агрегаты по метрикам, поддерживаются триггерами
+        weekly_rollups.init_rollup_tables(cursor)
+
+        # Журнал ночных пересчётов и колонки предвычисленных полей
+        batch_jobs.init_batch_tables(cursor)
+
         conn.commit()
         conn.close()
         print("✅ Все таблицы инициализированы.")
 
 # Вызов при запуске
 init_tables()
+page_cache.render_pages(app)
 
 def setup_telegram_webhook():
     """Автоматическая настройка webhook при запуске"""
@@ -963,12 +1390,10 @@ def setup_telegram_webhook():
             print("🤖 Настройка Telegram webhook...")
             
             # Устанавливаем webhook
-            url = f"https://api.telegram.org/bot{bot_token}/setWebhook"
+            url = async_runtime.telegram_url("setWebhook", bot_token)
             data = {'url': webhook_url}
             
-            import requests
-            response = requests.post(url, data=data)
-            result = response.json()
+            result = async_runtime.post_sync(url, data=data)
             
             if result.get('ok'):
                 print("✅ Webhook успешно настроен!")
@@ -985,5 +1410,11 @@ if __name__ == "__main__":
     
     # Настраиваем webhook автоматически (временно отключено)
     # setup_telegram_webhook()
+
+    # Ночной пересчёт недель и норм веса
+    batch_jobs.start_scheduler()
+
+    # Фоновое резервное копирование базы
+    backup.start_scheduler()
     
     app.run(host="0.0.0.0", port=port, debug=False)
@@ -0,0 +1,233 @@
+import heapq
+import os
+import resource
+import threading
+import time
+import tracemalloc
+
+from flask import g, has_request_context, jsonify, request
+
+# Лимиты строк на один запрос к истории: при превышении отказываем сразу,
+# а не собираем список целиком на VM с 256 МБ
+DEFAULT_ROW_LIMIT = int(os.environ.get("MAX_RESPONSE_ROWS", 5000))
+ROW_LIMITS = {
+    "debug_all": 2000,
+}
+DEFAULT_BYTE_LIMIT = int(os.environ.get("MAX_RESPONSE_BYTES", 2 * 1024 * 1024))
+BYTE_LIMITS = {
+    "debug_all": 1024 * 1024,
+}
+FETCH_CHUNK = 500
+
+# Снимок tracemalloc дорогой — берём его для каждого N-го запроса к маршруту
+SAMPLE_EVERY = int(os.environ.get("MEMORY_SAMPLE_EVERY", 20))
+TOP_ALLOCATORS = 10
+LARGEST_RESPONSES = 20
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_lock = threading.Lock()
+_routes = {}
+_largest = []
+# tracemalloc считает выделения всего процесса: пик запроса честен, только если
+# за время запроса других запросов не было. _started растёт с каждым запросом.
+_in_flight = 0
+_started = 0
+
+
+class ResponseTooLarge(Exception):
+    def __init__(self, limit, unit="rows"):
+        super().__init__(f"response exceeds {limit} {unit}")
+        self.limit = limit
+        self.unit = unit
+
+
+def too_large_response(error):
+    response = jsonify({
+        "error": "Слишком большой ответ",
+        "limit": error.limit,
+        "unit": error.unit
+    })
+    response.status_code = 413
+    return response
+
+
+def _current_rss_kb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE // 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss_kb():
+    # ru_maxrss в Linux — в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def set_tracing(enabled):
+    """Включает или выключает tracemalloc на лету"""
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start(5)
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def _estimate_bytes(rows):
+    # Примерный размер строк в JSON: текст значений плюс кавычки и разделители
+    return sum(sum(len(str(value)) + 3 for value in row) + 2 for row in rows)
+
+
+def fetch_limited(cursor):
+    """fetchall с ограничением строк и примерного размера ответа для текущего эндпоинта.
+
+    Размер считается по мере чтения порций и копится за весь запрос (маршрут может
+    читать несколько таблиц), поэтому отказ происходит до того, как ответ собран в памяти.
+    """
+    endpoint = request.endpoint if has_request_context() else None
+    limit = ROW_LIMITS.get(endpoint, DEFAULT_ROW_LIMIT)
+    byte_limit = BYTE_LIMITS.get(endpoint, DEFAULT_BYTE_LIMIT)
+    estimated = g.get("memory_estimated_bytes", 0) if has_request_context() else 0
+    rows = []
+    while True:
+        chunk = cursor.fetchmany(FETCH_CHUNK)
+        if not chunk:
+            break
+        rows.extend(chunk)
+        if len(rows) > limit:
+            raise ResponseTooLarge(limit)
+        estimated += _estimate_bytes(chunk)
+        if estimated > byte_limit:
+            raise ResponseTooLarge(byte_limit, "bytes")
+    if has_request_context():
+        g.memory_estimated_bytes = estimated
+    return rows
+
+
+def before_request():
+    global _in_flight, _started
+    g.memory_rss_peak = _peak_rss_kb()
+    with _lock:
+        _in_flight += 1
+        _started += 1
+        g.memory_started = _started
+        alone = _in_flight == 1
+    g.memory_in_flight = True
+    if not tracemalloc.is_tracing():
+        return
+    route = request.endpoint or request.path
+    with _lock:
+        stats = _routes.setdefault(route, _empty_stats())
+        stats["seen"] += 1
+        sample = stats["seen"] % SAMPLE_EVERY == 1 or SAMPLE_EVERY <= 1
+    if not alone:
+        # reset_peak сбросил бы пик чужого запроса; этот запрос не измеряем
+        return
+    tracemalloc.reset_peak()
+    g.memory_traced_start = tracemalloc.get_traced_memory()[0]
+    g.memory_snapshot = tracemalloc.take_snapshot() if sample else None
+
+
+def teardown_request(error=None):
+    """Снимает запрос из числа выполняющихся — и при исключении, в отличие от after_request"""
+    global _in_flight
+    if g.pop("memory_in_flight", None):
+        with _lock:
+            _in_flight -= 1
+
+
+def _measured_alone():
+    # Никто не начал запрос после нас; начатые раньше исключены проверкой в before_request
+    with _lock:
+        return g.get("memory_started") == _started
+
+
+def _empty_stats():
+    return {
+        "seen": 0,
+        "requests": 0,
+        "max_rss_kb": 0,
+        "rss_growth_kb": 0,
+        "traced_peak_kb": 0,
+        "traced_requests": 0,
+        "max_response_bytes": 0,
+        "top_allocators": [],
+    }
+
+
+def after_request(response):
+    route = request.endpoint or request.path
+    # У потоковых ответов (SSE) длины нет: calculate_content_length прочитал бы поток целиком
+    size = None if response.is_streamed else response.calculate_content_length()
+
+    # Проверка уже собранного ответа: память на него уже потрачена, это лишь запасной
+    # барьер для маршрутов, которые читают не через fetch_limited
+    limit = BYTE_LIMITS.get(request.endpoint, DEFAULT_BYTE_LIMIT)
+    if size is not None and size > limit:
+        return too_large_response(ResponseTooLarge(limit, "bytes"))
+
+    rss_kb = _current_rss_kb()
+    growth_kb = max(0, _peak_rss_kb() - g.get("memory_rss_peak", 0))
+
+    traced_peak_kb = None
+    top = None
+    if tracemalloc.is_tracing() and g.get("memory_traced_start") is not None and _measured_alone():
+        traced_peak_kb = max(0, tracemalloc.get_traced_memory()[1] - g.memory_traced_start) // 1024
+        before = g.get("memory_snapshot")
+        if before is not None:
+            diff = tracemalloc.take_snapshot().compare_to(before, "lineno")
+            top = [
+                {"where": str(stat.traceback[0]), "size_kb": stat.size_diff // 1024, "count": stat.count_diff}
+                for stat in diff[:TOP_ALLOCATORS]
+                if stat.size_diff > 0
+            ]
+
+    with _lock:
+        stats = _routes.setdefault(route, _empty_stats())
+        stats["requests"] += 1
+        stats["max_rss_kb"] = max(stats["max_rss_kb"], rss_kb or 0)
+        stats["rss_growth_kb"] = max(stats["rss_growth_kb"], growth_kb)
+        if traced_peak_kb is not None:
+            stats["traced_peak_kb"] = max(stats["traced_peak_kb"], traced_peak_kb)
+            stats["traced_requests"] += 1
+        if size is not None:
+            stats["max_response_bytes"] = max(stats["max_response_bytes"], size)
+            entry = (size, time.time(), route, request.full_path)
+            if len(_largest) < LARGEST_RESPONSES:
+                heapq.heappush(_largest, entry)
+            elif size > _largest[0][0]:
+                heapq.heapreplace(_largest, entry)
+        if top is not None:
+            stats["top_allocators"] = top
+    return response
+
+
+def report():
+    """Сводка для /admin/memory"""
+    with _lock:
+        routes = {route: dict(stats) for route, stats in _routes.items()}
+        largest = sorted(_largest, reverse=True)
+    traced = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else None
+    return {
+        "tracemalloc": tracemalloc.is_tracing(),
+        "rss_kb": _current_rss_kb(),
+        "peak_rss_kb": _peak_rss_kb(),
+        "traced_current_kb": traced[0] // 1024 if traced else None,
+        "routes": routes,
+        "largest_responses": [
+            {"bytes": size, "route": route, "path": path, "at": round(at)}
+            for size, at, route, path in largest
+        ],
+        "limits": {
+            "default_rows": DEFAULT_ROW_LIMIT,
+            "rows": ROW_LIMITS,
+            "default_bytes": DEFAULT_BYTE_LIMIT,
+            "bytes": BYTE_LIMITS,
+        },
+    }
+
+
+def reset():
+    with _lock:
+        _routes.clear()
+        _largest.clear()
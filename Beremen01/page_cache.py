@@ -0,0 +1,87 @@
+import gzip
+import hashlib
+import os
+import threading
+
+from flask import Response, render_template, request
+
+import wire_format
+
+# Шаблоны страниц без контекста: рендерим один раз и держим в памяти
+PAGES = [
+    "welcome.html",
+    "choose.html",
+    "index.html",
+    "weight.html",
+    "pressure.html",
+    "mood.html",
+    "sugar.html",
+    "monitoring.html",
+    "tests.html",
+]
+
+_pages = {}
+_lock = threading.Lock()
+_app = None
+
+
+def _dev_mode():
+    return os.environ.get("PAGE_CACHE_DEV") == "1" or (_app is not None and _app.debug)
+
+
+def _template_mtime(name):
+    path = os.path.join(_app.root_path, _app.template_folder, name)
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _render(name):
+    with _app.app_context():
+        body = render_template(name).encode("utf-8")
+    digest = hashlib.sha256(body).hexdigest()[:20]
+    entry = {
+        "identity": body,
+        "gzip": gzip.compress(body, compresslevel=9),
+        "br": wire_format.brotli.compress(body, quality=11) if wire_format.brotli else None,
+        "etag": digest,
+        "mtime": _template_mtime(name),
+    }
+    with _lock:
+        _pages[name] = entry
+    return entry
+
+
+def render_pages(app, names=PAGES):
+    """Рендерит и сжимает страницы при старте приложения"""
+    global _app
+    _app = app
+    for name in names:
+        _render(name)
+    print(f"📄 Предрендерено страниц: {len(names)}")
+
+
+def serve_page(name):
+    """Отдаёт готовую страницу: ETag/304 и выбор gzip/br по Accept-Encoding"""
+    entry = _pages.get(name)
+    if entry is None or (_dev_mode() and _template_mtime(name) != entry["mtime"]):
+        entry = _render(name)
+
+    # У каждого варианта кодирования свой сильный ETag
+    encoding = wire_format.pick_encoding(request.headers.get("Accept-Encoding", ""))
+    if encoding and entry[encoding] is None:
+        encoding = None
+    etag = entry["etag"] if encoding is None else f"{entry['etag']}-{encoding}"
+
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(entry[encoding or "identity"], mimetype="text/html")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Accept-Encoding")
+    return response
@@ -0,0 +1,61 @@
+from datetime import date
+
+
+def calculate_weight_norm(week, height_cm, start_weight):
+    if not week or not height_cm or not start_weight:
+        return None
+
+    height_m = height_cm / 100
+    bmi = start_weight / (height_m ** 2)
+
+    if bmi < 18.5:
+        category = "underweight"
+        base_gain = 1.2
+    elif 18.5 <= bmi < 25:
+        category = "normal"
+        base_gain = 1.0
+    elif 25 <= bmi < 30:
+        category = "overweight"
+        base_gain = 0.7
+    else:
+        category = "obese"
+        base_gain = 0.5
+
+    # Первая прибавка появляется после 8-й недели
+    if week < 9:
+        return {
+            "bmi": round(bmi, 1),
+            "category": category,
+            "min_kg": 0,
+            "max_kg": 0
+        }
+
+    # Мосгорздрав: прирост массы тела после 8-й недели
+    weeks_with_gain = week - 8
+    min_kg = weeks_with_gain * (base_gain - 0.2)
+    max_kg = weeks_with_gain * (base_gain + 0.2)
+
+    return {
+        "bmi": round(bmi, 1),
+        "category": category,
+        "min_kg": round(min_kg, 1),
+        "max_kg": round(max_kg, 1)
+    }
+
+
+def pregnancy_week(start_date, today=None):
+    """Полных недель от даты начала беременности (не меньше 0)"""
+    today = today or date.today()
+    diff_days = (today - date.fromisoformat(start_date)).days
+    return max(0, diff_days // 7)
+
+
+def trimester(week):
+    """Триместр по числу полных недель: до 14-й — первый, до 28-й — второй"""
+    if week is None:
+        return None
+    if week < 14:
+        return 1
+    if week < 28:
+        return 2
+    return 3
@@ -0,0 +1,391 @@
+import os
+import sqlite3
+import sys
+import threading
+from datetime import date, datetime
+
+import async_runtime
+
+# Абсолютные пороги гипертензии беременных (мм рт. ст.)
+HYPERTENSION_SYSTOLIC = 140
+HYPERTENSION_DIASTOLIC = 90
+SEVERE_SYSTOLIC = 160
+SEVERE_DIASTOLIC = 110
+
+# Подъём относительно индивидуальной нормы из normal_pressure
+BASELINE_SYSTOLIC_RISE = 30
+BASELINE_DIASTOLIC_RISE = 15
+
+# Скользящее состояние
+EWMA_ALPHA = 0.3
+WINDOW_DAYS = 7
+PERSISTENT_HIGH_DAYS = 3
+WINDOW_MASK = (1 << WINDOW_DAYS) - 1
+
+ALERT_LEVELS = {
+    None: 0,
+    "above_baseline": 1,
+    "hypertension": 2,
+    "persistent": 3,
+    "severe": 4,
+}
+
+ALERT_TEXTS = {
+    "above_baseline": "⚠️ Давление {systolic}/{diastolic} заметно выше вашей нормы {baseline}. Отдохните и перемерьте через 15 минут.",
+    "hypertension": "⚠️ Давление {systolic}/{diastolic} выше 140/90. Перемерьте и сообщите врачу, если повторится.",
+    "persistent": "🩺 Повышенное давление {high_days} раз(а) за последние {window} дней. Пожалуйста, обратитесь к врачу.",
+    "severe": "🚨 Давление {systolic}/{diastolic} — опасно высокое. Срочно обратитесь к врачу или вызовите скорую (103).",
+}
+
+_sender_lock = threading.Lock()
+
+
+def init_alert_tables(cursor):
+    """Создаёт таблицы состояния алертов и очереди уведомлений"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pressure_alert_state (
+            user_id TEXT PRIMARY KEY,
+            ewma_systolic REAL,
+            ewma_diastolic REAL,
+            prev_ewma_systolic REAL,
+            prev_ewma_diastolic REAL,
+            readings INTEGER,
+            last_date TEXT,
+            high_mask INTEGER,
+            high_days INTEGER,
+            alert_level TEXT,
+            alert_date TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notification_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            kind TEXT,
+            text TEXT,
+            attempts INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_notification_queue_pending
+        ON notification_queue (sent_at, id)
+    """)
+
+
+def classify_reading(systolic, diastolic, baseline):
+    """Возвращает список флагов для одного измерения"""
+    flags = []
+    if systolic >= SEVERE_SYSTOLIC or diastolic >= SEVERE_DIASTOLIC:
+        flags.append("severe")
+    if systolic >= HYPERTENSION_SYSTOLIC or diastolic >= HYPERTENSION_DIASTOLIC:
+        flags.append("hypertension")
+    if baseline and baseline[0] and baseline[1]:
+        if (systolic - baseline[0] >= BASELINE_SYSTOLIC_RISE
+                or diastolic - baseline[1] >= BASELINE_DIASTOLIC_RISE):
+            flags.append("above_baseline")
+    return flags
+
+
+def _parse_day(date_str):
+    return datetime.fromisoformat(date_str).date()
+
+
+def _fold(state, day, systolic, diastolic, baseline):
+    """Применяет одно измерение к состоянию пользователя за O(1).
+
+    Повторное измерение за last_date — это перезапись (UNIQUE(user_id, date)),
+    поэтому EWMA пересчитывается от значения до этого дня.
+    """
+    flags = classify_reading(systolic, diastolic, baseline)
+    is_high = 1 if flags else 0
+
+    if state is None:
+        state = {
+            "ewma_systolic": float(systolic),
+            "ewma_diastolic": float(diastolic),
+            "prev_ewma_systolic": None,
+            "prev_ewma_diastolic": None,
+            "readings": 1,
+            "last_date": day,
+            "high_mask": is_high,
+        }
+    else:
+        shift = (day - state["last_date"]).days
+        if shift == 0:
+            prev_sys = state["prev_ewma_systolic"]
+            prev_dia = state["prev_ewma_diastolic"]
+            if prev_sys is None:
+                state["ewma_systolic"] = float(systolic)
+                state["ewma_diastolic"] = float(diastolic)
+            else:
+                state["ewma_systolic"] = EWMA_ALPHA * systolic + (1 - EWMA_ALPHA) * prev_sys
+                state["ewma_diastolic"] = EWMA_ALPHA * diastolic + (1 - EWMA_ALPHA) * prev_dia
+            state["high_mask"] = (state["high_mask"] & ~1) | is_high
+        else:
+            # Измерение задним числом учитываем в EWMA как последнее;
+            # точный порядок восстанавливает rebuild_alert_state
+            if shift > 0:
+                state["prev_ewma_systolic"] = state["ewma_systolic"]
+                state["prev_ewma_diastolic"] = state["ewma_diastolic"]
+            state["ewma_systolic"] = EWMA_ALPHA * systolic + (1 - EWMA_ALPHA) * state["ewma_systolic"]
+            state["ewma_diastolic"] = EWMA_ALPHA * diastolic + (1 - EWMA_ALPHA) * state["ewma_diastolic"]
+            state["readings"] += 1
+            if shift > 0:
+                mask = (state["high_mask"] << shift) & WINDOW_MASK if shift < WINDOW_DAYS else 0
+                state["high_mask"] = mask | is_high
+                state["last_date"] = day
+            elif -shift < WINDOW_DAYS:
+                bit = 1 << -shift
+                state["high_mask"] = (state["high_mask"] & ~bit) | (bit if is_high else 0)
+
+    state["high_days"] = bin(state["high_mask"]).count("1")
+    if state["high_days"] >= PERSISTENT_HIGH_DAYS:
+        flags.append("persistent")
+    return state, flags
+
+
+def _load_state(cursor, user_id):
+    cursor.execute("""
+        SELECT ewma_systolic, ewma_diastolic, prev_ewma_systolic, prev_ewma_diastolic,
+               readings, last_date, high_mask, alert_level, alert_date
+        FROM pressure_alert_state WHERE user_id = ?
+    """, (user_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None, None, None
+    state = {
+        "ewma_systolic": row[0],
+        "ewma_diastolic": row[1],
+        "prev_ewma_systolic": row[2],
+        "prev_ewma_diastolic": row[3],
+        "readings": row[4],
+        "last_date": date.fromisoformat(row[5]),
+        "high_mask": row[6],
+    }
+    return state, row[7], row[8]
+
+
+def _store_state(cursor, user_id, state, alert_level, alert_date):
+    cursor.execute("""
+        INSERT OR REPLACE INTO pressure_alert_state (
+            user_id, ewma_systolic, ewma_diastolic, prev_ewma_systolic, prev_ewma_diastolic,
+            readings, last_date, high_mask, high_days, alert_level, alert_date, updated_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """, (
+        user_id,
+        state["ewma_systolic"],
+        state["ewma_diastolic"],
+        state["prev_ewma_systolic"],
+        state["prev_ewma_diastolic"],
+        state["readings"],
+        state["last_date"].isoformat(),
+        state["high_mask"],
+        state["high_days"],
+        alert_level,
+        alert_date,
+    ))
+
+
+def _top_flag(flags):
+    return max(flags, key=lambda f: ALERT_LEVELS[f]) if flags else None
+
+
+def _should_alert(top, day, alert_level, alert_date):
+    """Не больше одного уведомления в день, кроме повышения уровня"""
+    if not top:
+        return False
+    if alert_date is None or day.isoformat() > alert_date:
+        return True
+    return ALERT_LEVELS[top] > ALERT_LEVELS.get(alert_level, 0)
+
+
+def update_alert_state(cursor, user_id, date_str, systolic, diastolic):
+    """Обновляет состояние после сохранения измерения.
+
+    Вызывается в той же транзакции, что и INSERT в pressure_entries:
+    два поиска по первичному ключу и одна запись, без чтения истории.
+    Возвращает True, если в очередь поставлено уведомление.
+    """
+    systolic = int(systolic)
+    diastolic = int(diastolic)
+    day = _parse_day(date_str)
+
+    cursor.execute("SELECT systolic, diastolic FROM normal_pressure WHERE user_id = ?", (user_id,))
+    baseline = cursor.fetchone()
+
+    state, alert_level, alert_date = _load_state(cursor, user_id)
+    state, flags = _fold(state, day, systolic, diastolic, baseline)
+
+    top = _top_flag(flags)
+    queued = False
+    if _should_alert(top, day, alert_level, alert_date):
+        text = ALERT_TEXTS[top].format(
+            systolic=systolic,
+            diastolic=diastolic,
+            baseline=f"{baseline[0]}/{baseline[1]}" if baseline else "",
+            high_days=state["high_days"],
+            window=WINDOW_DAYS,
+        )
+        cursor.execute("""
+            INSERT INTO notification_queue (user_id, kind, text)
+            VALUES (?, ?, ?)
+        """, (user_id, top, text))
+        alert_level, alert_date = top, max(alert_date or "", day.isoformat())
+        queued = True
+
+    _store_state(cursor, user_id, state, alert_level, alert_date)
+    return queued
+
+
+def load_alert_state(cursor, user_id):
+    """Текущее состояние алертов для ответа API"""
+    cursor.execute("""
+        SELECT ewma_systolic, ewma_diastolic, high_days, last_date, alert_level, alert_date
+        FROM pressure_alert_state WHERE user_id = ?
+    """, (user_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return {
+        "ewma_systolic": round(row[0], 1),
+        "ewma_diastolic": round(row[1], 1),
+        "high_days": row[2],
+        "window_days": WINDOW_DAYS,
+        "last_date": row[3],
+        "alert_level": row[4],
+        "alert_date": row[5],
+    }
+
+
+def rebuild_alert_state(conn, user_id=None):
+    """Пересчитывает состояние из истории pressure_entries.
+
+    Уведомления повторно не ставятся в очередь. Возвращает число пользователей.
+    """
+    cursor = conn.cursor()
+    history = conn.cursor()
+    if user_id:
+        cursor.execute("DELETE FROM pressure_alert_state WHERE user_id = ?", (user_id,))
+        history.execute("""
+            SELECT p.user_id, p.date, p.systolic, p.diastolic, n.systolic, n.diastolic
+            FROM pressure_entries p LEFT JOIN normal_pressure n ON n.user_id = p.user_id
+            WHERE p.user_id = ?
+            ORDER BY p.user_id, p.date
+        """, (user_id,))
+    else:
+        cursor.execute("DELETE FROM pressure_alert_state")
+        history.execute("""
+            SELECT p.user_id, p.date, p.systolic, p.diastolic, n.systolic, n.diastolic
+            FROM pressure_entries p LEFT JOIN normal_pressure n ON n.user_id = p.user_id
+            ORDER BY p.user_id, p.date
+        """)
+
+    users = 0
+    current_user = None
+    state = alert_level = alert_date = None
+
+    def flush():
+        if current_user is not None and state is not None:
+            _store_state(cursor, current_user, state, alert_level, alert_date)
+
+    for uid, date_str, systolic, diastolic, base_sys, base_dia in history:
+        if uid != current_user:
+            flush()
+            current_user = uid
+            state = alert_level = alert_date = None
+            users += 1
+        try:
+            day = _parse_day(date_str)
+            state, flags = _fold(state, day, int(systolic), int(diastolic), (base_sys, base_dia))
+        except (ValueError, TypeError) as e:
+            print(f"Пропущена запись давления {uid} {date_str}: {e}")
+            continue
+        top = _top_flag(flags)
+        if _should_alert(top, day, alert_level, alert_date):
+            alert_level, alert_date = top, max(alert_date or "", day.isoformat())
+    flush()
+
+    conn.commit()
+    return users
+
+
+def send_pending_notifications(conn, limit=50):
+    """Отправляет накопленные уведомления через Telegram Bot API"""
+    bot_token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    if not bot_token:
+        return 0
+
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, user_id, text FROM notification_queue
+        WHERE sent_at IS NULL AND attempts < 5
+        ORDER BY id
+        LIMIT ?
+    """, (limit,))
+    pending = cursor.fetchall()
+
+    # Все сообщения уходят разом через общий пул соединений async_runtime,
+    # а отметки в очереди ставятся по мере получения ответов
+    url = async_runtime.telegram_url("sendMessage", bot_token)
+    futures = [
+        (notification_id, async_runtime.post_nowait(url, json={"chat_id": user_id, "text": text}))
+        for notification_id, user_id, text in pending
+    ]
+    sent = 0
+    for notification_id, future in futures:
+        try:
+            status, body = future.result(timeout=async_runtime.HTTP_TIMEOUT + 1)
+            ok = status < 400 and bool(body.get("ok"))
+        except Exception as e:
+            print(f"Ошибка отправки уведомления {notification_id}: {e}")
+            ok = False
+        if ok:
+            cursor.execute("UPDATE notification_queue SET sent_at = CURRENT_TIMESTAMP WHERE id = ?", (notification_id,))
+            sent += 1
+        else:
+            cursor.execute("UPDATE notification_queue SET attempts = attempts + 1 WHERE id = ?", (notification_id,))
+        conn.commit()
+    return sent
+
+
+def flush_notifications_async(db_path="pregnancy.db"):
+    """Отправляет очередь в фоновом потоке, не задерживая запрос"""
+    if not os.environ.get("TELEGRAM_BOT_TOKEN"):
+        return
+
+    def worker():
+        if not _sender_lock.acquire(blocking=False):
+            return
+        try:
+            conn = sqlite3.connect(db_path)
+            try:
+                send_pending_notifications(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Ошибка в очереди уведомлений: {e}")
+        finally:
+            _sender_lock.release()
+
+    threading.Thread(target=worker, daemon=True).start()
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "rebuild"
+    conn = sqlite3.connect("pregnancy.db")
+    init_alert_tables(conn.cursor())
+
+    if command == "rebuild":
+        user_id = sys.argv[2] if len(sys.argv) > 2 else None
+        count = rebuild_alert_state(conn, user_id)
+        print(f"✅ Состояние алертов давления пересчитано для {count} пользователей")
+    elif command == "send":
+        count = send_pending_notifications(conn)
+        print(f"📨 Отправлено уведомлений: {count}")
+    else:
+        print("Использование: python pressure_alerts.py [rebuild [user_id] | send]")
+
+    conn.close()
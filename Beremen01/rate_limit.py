@@ -0,0 +1,180 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import jsonify, request
+
+# Состояние ведёр — в отдельном небольшом файле SQLite рядом с базой: его видят все
+# воркеры, а блокировки лимитера не мешают записи в pregnancy.db
+DB_PATH = os.environ.get("RATE_LIMIT_DB", "rate_limit.db")
+
+# Ведро на пару (пользователь, класс маршрута): BURST запросов подряд,
+# дальше — RATE запросов в секунду. BURST=0 отключает лимит класса.
+LIMITS = {
+    "write": (float(os.environ.get("RATE_WRITE_BURST", 20)), float(os.environ.get("RATE_WRITE_PER_SEC", 1))),
+    "read": (float(os.environ.get("RATE_READ_BURST", 60)), float(os.environ.get("RATE_READ_PER_SEC", 5))),
+}
+# Пакет записей держит блокировку записи дольше: каждые ENTRIES_PER_TOKEN записей
+# стоят ещё один жетон, но не больше BURST — иначе большая синхронизация не прошла бы никогда
+ENTRIES_PER_TOKEN = int(os.environ.get("RATE_ENTRIES_PER_TOKEN", 25))
+# Сколько ждать блокировку файла лимитера; дольше — пропускаем запрос без проверки
+LOCK_TIMEOUT = float(os.environ.get("RATE_LIMIT_LOCK_TIMEOUT", 0.05))
+# Раз в столько проверок удаляем ведра, которые уже наполнились до краёв
+PRUNE_EVERY = 10000
+
+# Одна команда: пополнить ведро за прошедшее время, взять cost жетонов, если они есть,
+# и вернуть решение. Отдельных SELECT и UPDATE нет — нет и гонки между воркерами.
+_REFILLED = "min(:burst, tokens + max(0, :now - updated) * :rate)"
+_TAKE = f"""
+INSERT INTO buckets (key, tokens, updated, allowed) VALUES (:key, :burst - :cost, :now, 1)
+ON CONFLICT(key) DO UPDATE SET
+    allowed = {_REFILLED} >= :cost,
+    tokens = CASE WHEN {_REFILLED} >= :cost THEN {_REFILLED} - :cost ELSE {_REFILLED} END,
+    updated = :now
+RETURNING allowed, tokens
+"""
+
+_local = threading.local()
+_lock = threading.Lock()
+_stats = {"allowed": {kind: 0 for kind in LIMITS}, "limited": {kind: 0 for kind in LIMITS}, "errors": 0}
+
+
+def route_class(endpoint):
+    """save_* и register_user — запись; load_*, get_* и bootstrap — чтение; остальные без лимита"""
+    if not endpoint:
+        return None
+    if endpoint.startswith("save_") or endpoint == "register_user":
+        return "write"
+    if endpoint.startswith(("load_", "get_")) or endpoint == "bootstrap":
+        return "read"
+    return None
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=LOCK_TIMEOUT, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Потеря состояния при сбое питания — лишь несколько лишних запросов
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, allowed INTEGER NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        _local.conn = conn
+        _local.checks = 0
+    return conn
+
+
+def _prune(conn, now):
+    # Полное ведро ничем не отличается от отсутствующего
+    longest = max((burst / rate for burst, rate in LIMITS.values() if burst > 0 and rate > 0), default=0)
+    conn.execute("DELETE FROM buckets WHERE updated < ?", (now - longest,))
+
+
+def _take(conn, key, burst, rate, cost, now):
+    return conn.execute(_TAKE, {"key": key, "burst": burst, "rate": rate, "cost": cost, "now": now}).fetchone()
+
+
+def check(charges, kind, now=None):
+    """Берёт жетоны из вёдер; возвращает (пропустить, через сколько секунд повторить).
+
+    charges — {user_id: сколько жетонов}. Несколько пользователей списываются в одной
+    транзакции: если хотя бы одному не хватило, не списывается ни у кого.
+    При любой ошибке SQLite запрос пропускается: лимитер не должен ронять сервис.
+    """
+    burst, rate = LIMITS[kind]
+    if burst <= 0 or not charges:
+        return True, 0
+    now = time.time() if now is None else now
+    denied = None
+    try:
+        conn = _connect()
+        if len(charges) == 1:
+            (user_id, cost), = charges.items()
+            allowed, tokens = _take(conn, f"{kind}:{user_id}", burst, rate, cost, now)
+            if not allowed:
+                denied = (cost, tokens)
+        else:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, cost in charges.items():
+                    allowed, tokens = _take(conn, f"{kind}:{user_id}", burst, rate, cost, now)
+                    if not allowed:
+                        denied = (cost, tokens)
+                        break
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("ROLLBACK" if denied else "COMMIT")
+        _local.checks += 1
+        if _local.checks % PRUNE_EVERY == 0:
+            _prune(conn, now)
+    except sqlite3.Error as e:
+        print(f"⚠️ Лимитер недоступен, запрос пропущен: {e}")
+        with _lock:
+            _stats["errors"] += 1
+        return True, 0
+    with _lock:
+        _stats["limited" if denied else "allowed"][kind] += 1
+    if denied is None:
+        return True, 0
+    cost, tokens = denied
+    return False, max(1, math.ceil((cost - tokens) / rate)) if rate > 0 else 60
+
+
+def _charges(kind):
+    """{user_id: жетоны} для запроса: чтение — один жетон, пакет записи — по числу записей каждого"""
+    burst = LIMITS[kind][0]
+    user_id = request.args.get("user_id")
+    if user_id:
+        return {str(user_id): 1}
+    body = request.get_json(silent=True) if request.method == "POST" else None
+    common = {}
+    if isinstance(body, dict):
+        if "entries" not in body:
+            return {str(body["user_id"]): 1} if body.get("user_id") is not None else {}
+        common, body = body, body["entries"]
+    if not isinstance(body, list):
+        return {}
+    entries = {}
+    for item in body:
+        if not isinstance(item, dict):
+            continue
+        item_user = item.get("user_id", common.get("user_id"))
+        if item_user is not None:
+            entries[str(item_user)] = entries.get(str(item_user), 0) + 1
+    return {item_user: min(burst, 1 + (count - 1) // ENTRIES_PER_TOKEN)
+            for item_user, count in entries.items()}
+
+
+def limited_response(kind, retry_after):
+    response = jsonify({"error": "Слишком много запросов, повторите позже", "reason": f"rate_limit:{kind}"})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+def before_request():
+    """Отказывает до проверки тела и до очереди к БД; запросы без user_id не ограничиваются"""
+    kind = route_class(request.endpoint)
+    if kind is None or LIMITS[kind][0] <= 0:
+        return None
+    allowed, retry_after = check(_charges(kind), kind)
+    if allowed:
+        return None
+    return limited_response(kind, retry_after)
+
+
+def report():
+    with _lock:
+        return {
+            "allowed": dict(_stats["allowed"]),
+            "limited": dict(_stats["limited"]),
+            "errors": _stats["errors"],
+            "limits": {kind: {"burst": burst, "per_sec": rate} for kind, (burst, rate) in LIMITS.items()},
+            "entries_per_token": ENTRIES_PER_TOKEN,
+        }
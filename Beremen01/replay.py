@@ -0,0 +1,418 @@
+"""Воспроизведение трафика, записанного traffic_capture.py, и сравнение задержек сборок.
+
+  python replay.py prepare <снимок.db.gz> <pregnancy.db>   — обезличенная копия базы
+  python replay.py run <трафик.jsonl.gz> [--speed 10] [--snapshot <снимок.db.gz>]
+                       [--app-dir <каталог сборки>] [--asgi] [--rate-limit] [--url http://...]
+                       [--out итог.json]
+  python replay.py compare <было.json> <стало.json>
+
+Без --url поднимается локальный сервер из --app-dir (по умолчанию — этот каталог) на
+обезличенной копии снимка из backup.py. Значения в телах запросов генерируются
+детерминированно (--seed), даты сохраняют сдвиг от дня записи, user_id — те же
+псевдонимы, что в снимке. Для prepare и run со снимком нужен тот же CAPTURE_KEY.
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import secrets
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import requests
+
+import backup
+import request_stats
+import traffic_capture
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Правдоподобные значения числовых полей — чтобы запросы проходили проверку схем
+FIELD_VALUES = {
+    "weight": lambda rng: round(rng.uniform(50, 95), 1),
+    "height": lambda rng: rng.randint(150, 185),
+    "systolic": lambda rng: rng.randint(100, 145),
+    "diastolic": lambda rng: rng.randint(60, 95),
+    "sugar": lambda rng: round(rng.uniform(3.8, 6.5), 1),
+    "mood": lambda rng: rng.randint(1, 3),
+    "wellbeing": lambda rng: rng.randint(1, 3),
+    "weeks": lambda rng: rng.randint(4, 40),
+    "limit": lambda rng: 50,
+}
+STRING_VALUES = {
+    "username": "replay",
+}
+SERVER_START_TIMEOUT = 30
+
+# Кроме user_id в снимке есть свободный текст, по которому узнаётся человек:
+# имена из Telegram заменяются псевдонимами, тексты уведомлений стираются
+PSEUDONYM_COLUMNS = ("username", "first_name", "last_name")
+ERASED_COLUMNS = ("text", "phone")
+
+
+def load_trace(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    records = []
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def prepare_snapshot(snapshot_path, db_path, key):
+    """Копия снимка, где все user_id заменены псевдонимами из записи трафика.
+
+    В том же проходе во всех таблицах столбцы PSEUDONYM_COLUMNS (users.username)
+    заменяются псевдонимами HMAC, а ERASED_COLUMNS (notification_queue.text)
+    очищаются. Измерения — вес, давление, сахар, даты — остаются как есть.
+    """
+    if snapshot_path.endswith(".gz"):
+        if not backup.verify_backup(snapshot_path):
+            raise RuntimeError(f"Снимок {snapshot_path} повреждён")
+        with gzip.open(snapshot_path, "rb") as src, open(db_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+    else:
+        shutil.copyfile(snapshot_path, db_path)
+
+    conn = sqlite3.connect(db_path)
+    conn.create_function("anonymise", 1,
+                         lambda value: None if value is None else traffic_capture.anonymise(value, key),
+                         deterministic=True)
+    cursor = conn.cursor()
+    # Триггеры агрегатов пересчитали бы недели на каждое обновление — снимаем их на время замены
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'")
+    triggers = cursor.fetchall()
+    for name, _ in triggers:
+        cursor.execute(f'DROP TRIGGER "{name}"')
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+    tables = [row[0] for row in cursor.fetchall()]
+    updated = 0
+    scrubbed = []
+    for table in tables:
+        columns = [row[1] for row in cursor.execute(f'PRAGMA table_info("{table}")')]
+        assignments = []
+        if "user_id" in columns:
+            assignments.append("user_id = anonymise(user_id)")
+            updated += 1
+        for column in columns:
+            if column in PSEUDONYM_COLUMNS:
+                assignments.append(f'"{column}" = \'u\' || anonymise("{column}")')
+            elif column in ERASED_COLUMNS:
+                assignments.append(f'"{column}" = CASE WHEN "{column}" IS NULL THEN NULL ELSE \'\' END')
+            else:
+                continue
+            scrubbed.append(f"{table}.{column}")
+        if assignments:
+            cursor.execute(f'UPDATE "{table}" SET {", ".join(assignments)}')
+    for _, sql in triggers:
+        cursor.execute(sql)
+    conn.commit()
+    conn.close()
+    print(f"🕶️ Снимок обезличен: {db_path} ({updated} таблиц с user_id; "
+          f"очищены {', '.join(scrubbed) or 'нет текстовых полей'})")
+
+
+def materialise(shape, rng, today, field=None, shift=0):
+    """Форма тела из записи -> конкретное тело запроса"""
+    if isinstance(shape, dict):
+        if "$id" in shape:
+            return shape["$id"]
+        if "$ids" in shape:
+            return list(shape["$ids"])
+        return {name: materialise(item, rng, today, name, shift) for name, item in shape.items()}
+    if isinstance(shape, list) and len(shape) == 3 and shape[0] == "*":
+        # Записи пакета — на разные дни, как при синхронизации накопленных данных
+        return [materialise(shape[2], rng, today, field, shift - i) for i in range(shape[1])]
+    if shape == "n":
+        generate = FIELD_VALUES.get(field)
+        return generate(rng) if generate else 0
+    if shape == "s":
+        return STRING_VALUES.get(field, "x")
+    if shape == "b":
+        return rng.random() < 0.5
+    if isinstance(shape, str) and shape.startswith("d"):
+        return (today + timedelta(days=int(shape[1:]) + shift)).isoformat()
+    return None
+
+
+def build_request(record, rng, today, etags, token):
+    params = {}
+    for name, value in record.get("q", {}).items():
+        if isinstance(value, dict) and "$id" in value:
+            params[name] = value["$id"]
+        elif isinstance(value, dict) and "$ids" in value:
+            params[name] = ",".join(value["$ids"])
+        else:
+            params[name] = value
+
+    recorded = record.get("h", {})
+    # requests по умолчанию просит gzip — отправляем ровно то, что присылал клиент
+    headers = {"Accept-Encoding": recorded.get("Accept-Encoding", "identity")}
+    if recorded.get("Accept"):
+        headers["Accept"] = recorded["Accept"]
+    if recorded.get("If-None-Match") and record["p"] in etags:
+        headers["If-None-Match"] = etags[record["p"]]
+    if recorded.get("auth"):
+        headers["X-Admin-Token"] = token
+
+    body = materialise(record["b"], rng, today) if "b" in record else None
+    return record["m"], record["p"], params, body, headers
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_local_server(app_dir, workdir, token, asgi=False, rate_limit=False):
+    """Сервер сборки app_dir на базе workdir/pregnancy.db; без фоновых заданий и Telegram.
+
+    Лимит запросов на пользователя по умолчанию выключен: ускоренный прогон упирается
+    в него мгновенными 429, и сравнение со сборками без лимитера теряет смысл.
+    """
+    port = _free_port()
+    if asgi:
+        code = ("import uvicorn, asgi; "
+                f"uvicorn.run(asgi.app, host='127.0.0.1', port={port}, log_level='warning', lifespan='off')")
+    else:
+        code = f"import main; main.app.run(host='127.0.0.1', port={port}, threaded=True)"
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": os.path.abspath(app_dir),
+        "ADMIN_TOKEN": token,
+        "CLINICIAN_TOKEN": token,
+        "TELEGRAM_BOT_TOKEN": "",
+        "TRAFFIC_CAPTURE": "",
+        "BACKUP_INTERVAL_HOURS": "0",
+    })
+    if not rate_limit:
+        env.update({"RATE_WRITE_BURST": "0", "RATE_READ_BURST": "0"})
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    process = subprocess.Popen([sys.executable, "-c", code], cwd=workdir, env=env, stdout=log, stderr=log)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Сервер не запустился, см. {log.name}")
+        try:
+            requests.get(f"{url}/health", timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Сервер не ответил за отведённое время")
+
+
+def replay(records, url, speed=1.0, concurrency=32, seed=0, token=""):
+    """Отправляет запросы в записанном темпе, ускоренном в speed раз (0 — без пауз).
+
+    Возвращает [(маршрут, статус, мс, опоздание мс)]; опоздание — сколько запрос
+    ждал свободного клиента после своего времени по расписанию.
+    """
+    today = date.today()
+    etags = {}
+    local = threading.local()
+    samples = [None] * len(records)
+
+    def send(index, record, due):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        rng = random.Random(f"{seed}:{index}")
+        method, path, params, body, headers = build_request(record, rng, today, etags, token)
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url + path, params=params, json=body, headers=headers, timeout=60)
+            status = response.status_code
+            if response.headers.get("ETag"):
+                etags[path] = response.headers["ETag"]
+        except requests.RequestException:
+            status = 0
+        elapsed = time.perf_counter() - started
+        samples[index] = (record.get("r") or path, status, round(elapsed * 1000, 2),
+                          round(max(0.0, started - due) * 1000, 2))
+
+    if not records:
+        return []
+    first = records[0]["t"]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index, record in enumerate(records):
+            due = start + ((record["t"] - first) / speed if speed > 0 else 0)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, index, record, due)
+    return [sample for sample in samples if sample is not None]
+
+
+def summarise(samples):
+    """{маршрут: {count, errors, limited, p50, p95, p99}} и строка "*" по всем запросам.
+
+    Ответы 429 от лимитера быстрые и ничего не делают с базой — в перцентили
+    они не входят, а считаются отдельно в limited.
+    """
+    groups = {"*": []}
+    counts = {"*": 0}
+    errors = {"*": 0}
+    limited = {"*": 0}
+    for route, status, ms, _ in samples:
+        for key in ("*", route):
+            groups.setdefault(key, [])
+            counts[key] = counts.get(key, 0) + 1
+            errors[key] = errors.get(key, 0) + (status == 0 or status >= 500)
+            limited[key] = limited.get(key, 0) + (status == 429)
+            if status != 429:
+                groups[key].append(ms)
+    result = {}
+    for route, values in groups.items():
+        values.sort()
+        result[route] = {
+            "count": counts[route],
+            "errors": errors[route],
+            "limited": limited[route],
+        }
+        for q in (50, 95, 99):
+            value = request_stats._percentile(values, q)
+            result[route][f"p{q}"] = None if value is None else round(value, 1)
+    return result
+
+
+def print_summary(summary):
+    header = f"{'маршрут':<28}{'запросов':>10}{'ошибок':>8}{'429':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}"
+    print(header)
+    print("-" * len(header))
+    for route, row in sorted(summary.items(), key=lambda item: -item[1]["count"]):
+        print(f"{route:<28}{row['count']:>10}{row['errors']:>8}{row.get('limited', 0):>8}"
+              f"{str(row['p50']):>10}{str(row['p95']):>10}{str(row['p99']):>10}")
+
+
+def _change(before, after):
+    if not before or after is None:
+        return "—"
+    return f"{(after - before) / before * 100:+.0f}%"
+
+
+def compare(before, after):
+    """Таблица p50/p95/p99 двух прогонов по маршрутам"""
+    a, b = before["summary"], after["summary"]
+    header = f"{'маршрут':<28}{'запросов':>10}{'p50':>16}{'p95':>16}{'p99':>16}{'Δp95':>8}"
+    print(f"было: {before['meta'].get('build')}  стало: {after['meta'].get('build')}")
+    print(header)
+    print("-" * len(header))
+    for route in sorted(set(a) | set(b), key=lambda name: -max(a.get(name, {}).get("count", 0),
+                                                               b.get(name, {}).get("count", 0))):
+        old, new = a.get(route, {}), b.get(route, {})
+        cells = "".join(f"{str(old.get(q)) + ' → ' + str(new.get(q)):>16}" for q in ("p50", "p95", "p99"))
+        print(f"{route:<28}{new.get('count', old.get('count', 0)):>10}{cells}{_change(old.get('p95'), new.get('p95')):>8}")
+
+
+def run(args):
+    records = load_trace(args.trace)
+    print(f"▶️ Записей: {len(records)}, скорость: {'без пауз' if args.speed <= 0 else f'{args.speed:g}x'}")
+    token = secrets.token_hex(8)
+    process = None
+    workdir = None
+    url = args.url
+    try:
+        if url is None:
+            workdir = tempfile.mkdtemp(prefix="replay-")
+            if args.snapshot:
+                key = os.environ.get("CAPTURE_KEY")
+                if not key:
+                    raise SystemExit("Для снимка нужен CAPTURE_KEY, с которым записан трафик")
+                prepare_snapshot(args.snapshot, os.path.join(workdir, "pregnancy.db"), key)
+            else:
+                print("⚠️ Без --snapshot сервер стартует на пустой базе")
+            process, url = start_local_server(args.app_dir, workdir, token, args.asgi, args.rate_limit)
+        else:
+            token = os.environ.get("ADMIN_TOKEN", "")
+
+        started = time.perf_counter()
+        samples = replay(records, url, args.speed, args.concurrency, args.seed, token)
+        wall_s = time.perf_counter() - started
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = summarise(samples)
+    print_summary(summary)
+    lags = sorted(sample[3] for sample in samples)
+    print(f"⏱️ {wall_s:.1f} с, опоздание к расписанию p95: {request_stats._percentile(lags, 95)} мс")
+
+    result = {
+        "meta": {
+            "trace": args.trace,
+            "build": args.url or os.path.abspath(args.app_dir),
+            "speed": args.speed,
+            "seed": args.seed,
+            "asgi": args.asgi,
+            "wall_s": round(wall_s, 2),
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+        },
+        "summary": summary,
+        "samples": samples,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+    print(f"💾 Результат: {args.out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанного трафика")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="воспроизвести запись")
+    run_parser.add_argument("trace")
+    run_parser.add_argument("--speed", type=float, default=1.0, help="ускорение; 0 — без пауз")
+    run_parser.add_argument("--snapshot", help="снимок базы из backup.py (.db.gz или .db)")
+    run_parser.add_argument("--app-dir", default=HERE, help="каталог сборки для локального сервера")
+    run_parser.add_argument("--asgi", action="store_true", help="локальный сервер через uvicorn asgi:app")
+    run_parser.add_argument("--rate-limit", action="store_true",
+                            help="не выключать лимит запросов на пользователя на локальном сервере")
+    run_parser.add_argument("--url", help="не поднимать сервер, а слать запросы сюда")
+    run_parser.add_argument("--concurrency", type=int, default=32)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--out", default="replay-result.json")
+
+    prepare_parser = commands.add_parser("prepare", help="обезличить снимок базы")
+    prepare_parser.add_argument("snapshot")
+    prepare_parser.add_argument("db")
+
+    compare_parser = commands.add_parser("compare", help="сравнить два прогона")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    elif args.command == "prepare":
+        key = os.environ.get("CAPTURE_KEY")
+        if not key:
+            raise SystemExit("Нужен CAPTURE_KEY, с которым записан трафик")
+        prepare_snapshot(args.snapshot, args.db, key)
+    else:
+        with open(args.before, encoding="utf-8") as f:
+            before = json.load(f)
+        with open(args.after, encoding="utf-8") as f:
+            after = json.load(f)
+        compare(before, after)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import threading
+from collections import deque
+
+# Последние длительности запросов (мс), отдельно во время резервного копирования
+WINDOW = 2000
+
+_samples = {"normal": deque(maxlen=WINDOW), "during_backup": deque(maxlen=WINDOW)}
+_lock = threading.Lock()
+
+
+def record(duration_ms, during_backup=False):
+    with _lock:
+        _samples["during_backup" if during_backup else "normal"].append(duration_ms)
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return round(values[index], 2)
+
+
+def summary():
+    """p50/p95/p99 по окну — чтобы видеть, как копирование влияет на запросы"""
+    with _lock:
+        snapshot = {name: sorted(values) for name, values in _samples.items()}
+    return {
+        name: {
+            "count": len(values),
+            "p50_ms": _percentile(values, 50),
+            "p95_ms": _percentile(values, 95),
+            "p99_ms": _percentile(values, 99),
+        }
+        for name, values in snapshot.items()
+    }
@@ -0,0 +1,137 @@
+import os
+from functools import wraps
+
+from flask import jsonify, request
+
+# Сколько записей принимаем одним запросом (синхронизация накопленных офлайн-данных)
+MAX_BATCH = int(os.environ.get("MAX_BATCH_ENTRIES", 500))
+
+
+class Field:
+    """Поле тела запроса.
+
+    check — функция вида validate_* из main.py: значение -> (ok, сообщение);
+    convert — приведение типа после проверки; types — допустимые типы JSON.
+    """
+
+    def __init__(self, check=None, convert=None, types=None, required=True, default=None):
+        self.check = check
+        self.convert = convert
+        self.types = types
+        self.required = required
+        self.default = default
+
+
+def _compile_field(name, field):
+    check, convert, types = field.check, field.convert, field.types
+    required, default = field.required, field.default
+    missing = f"Не указано поле {name}"
+    wrong_type = f"Некорректный формат поля {name}"
+
+    def run(value):
+        if value is None:
+            if not required:
+                return default, None
+            if check is None:
+                return None, missing
+        # bool в JSON — тоже int, но числом здесь быть не может
+        elif isinstance(value, bool) or (types is not None and not isinstance(value, types)):
+            return None, wrong_type
+        if check is not None:
+            ok, message = check(value)
+            if not ok:
+                return None, message
+        if convert is None:
+            return value, None
+        try:
+            return convert(value), None
+        except (ValueError, TypeError):
+            return None, wrong_type
+
+    return run
+
+
+def compile_schema(fields, rules=()):
+    """Собирает проверку тела запроса один раз при импорте.
+
+    fields — {имя: Field}, rules — [(("поле1", "поле2"), check)] для проверок
+    нескольких полей сразу; они выполняются, только если сами поля корректны.
+    Возвращает функцию payload -> (записи, ошибки), где ошибки — {поле: сообщение}.
+    """
+    compiled = tuple((name, _compile_field(name, field)) for name, field in fields.items())
+    rules = tuple((tuple(names), check) for names, check in rules)
+
+    def validate_entry(entry, prefix):
+        if not isinstance(entry, dict):
+            return None, {prefix.rstrip(".") or "body": "Запись должна быть JSON-объектом"}
+        clean = {}
+        errors = {}
+        for name, run in compiled:
+            value, message = run(entry.get(name))
+            if message is None:
+                clean[name] = value
+            else:
+                errors[prefix + name] = message
+        if not errors:
+            for names, check in rules:
+                ok, message = check(*[clean[name] for name in names])
+                if not ok:
+                    errors[prefix + names[0]] = message
+                    break
+        return clean, errors
+
+    def validate(payload):
+        """Одна запись, список записей или {"entries": [...], общие поля}"""
+        if isinstance(payload, dict) and "entries" in payload:
+            common = {key: value for key, value in payload.items() if key != "entries"}
+            items = payload["entries"]
+            if not isinstance(items, list):
+                return [], {"entries": "entries должен быть списком"}
+            items = [{**common, **item} if isinstance(item, dict) else item for item in items]
+        elif isinstance(payload, list):
+            items = payload
+        elif isinstance(payload, dict):
+            clean, errors = validate_entry(payload, "")
+            return ([clean] if not errors else []), errors
+        else:
+            return [], {"body": "Тело запроса должно быть JSON-объектом или списком"}
+
+        if not items:
+            return [], {"entries": "Пустой список записей"}
+        if len(items) > MAX_BATCH:
+            return [], {"entries": f"Не больше {MAX_BATCH} записей за запрос"}
+
+        entries = []
+        errors = {}
+        for i, item in enumerate(items):
+            clean, item_errors = validate_entry(item, f"entries[{i}].")
+            if item_errors:
+                errors.update(item_errors)
+            else:
+                entries.append(clean)
+        return (entries if not errors else []), errors
+
+    return validate
+
+
+def error_response(errors):
+    response = jsonify({"error": next(iter(errors.values())), "fields": errors})
+    response.status_code = 400
+    return response
+
+
+def validate(schema):
+    """Проверяет тело запроса до вызова обработчика — и до соединения с БД.
+
+    Ставится над admission.limit: некорректный запрос не занимает место в очереди.
+    Обработчик получает список проверенных записей первым аргументом.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            entries, errors = schema(request.get_json(silent=True))
+            if errors:
+                return error_response(errors)
+            return view(entries, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,36 @@
+// Живые обновления: /events присылает новые и изменённые записи пользователя,
+// страница дописывает их в уже загруженные данные без повторной загрузки истории.
+
+// Записи вида [date, ...значения], отсортированные по дате: замена или вставка по месту
+function mergeEntry(entries, row, dateIndex = 0) {
+  const i = entries.findIndex(e => e[dateIndex] >= row[dateIndex]);
+  if (i === -1) {
+    entries.push(row);
+  } else if (entries[i][dateIndex] === row[dateIndex]) {
+    entries[i] = row;
+  } else {
+    entries.splice(i, 0, row);
+  }
+  return entries;
+}
+
+// handlers: { weight: data => ..., pressure: ..., reset: () => ... }
+// reset приходит, когда пропущенные события уже не восстановить — нужно перечитать данные
+function subscribeLive(userId, handlers) {
+  if (!userId || !window.EventSource) return null;
+  const source = new EventSource(`/events?user_id=${encodeURIComponent(userId)}`);
+
+  for (const [kind, handler] of Object.entries(handlers)) {
+    source.addEventListener(kind, event => handler(JSON.parse(event.data)));
+  }
+
+  // Обрыв браузер переподключает сам; при 503 (много подписчиков) поток закрыт — пробуем позже
+  source.addEventListener("error", () => {
+    if (source.readyState !== EventSource.CLOSED) return;
+    setTimeout(() => {
+      if (handlers.reset) handlers.reset();
+      subscribeLive(userId, handlers);
+    }, 30000);
+  });
+  return source;
+}
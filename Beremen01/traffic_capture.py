@@ -0,0 +1,230 @@
+import atexit
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from datetime import date
+
+from flask import g, request
+
+# Запись включается переменной TRAFFIC_CAPTURE=путь (или POST /admin/capture).
+# Файл — JSON Lines в gzip; каждый сброс дописывается отдельным gzip-блоком.
+CAPTURE_PATH = os.environ.get("TRAFFIC_CAPTURE")
+# Ключ HMAC для обезличивания user_id; тот же ключ нужен replay.py, чтобы обезличить снимок базы
+CAPTURE_KEY = os.environ.get("CAPTURE_KEY")
+# Доля пользователей в записи: выбираются по user_id, все их запросы пишутся целиком
+CAPTURE_SAMPLE = float(os.environ.get("CAPTURE_SAMPLE", 1.0))
+CAPTURE_MAX_BYTES = int(float(os.environ.get("CAPTURE_MAX_MB", 200)) * 1024 * 1024)
+FLUSH_SECONDS = 1.0
+
+# Не записываем служебные маршруты, поток /events и webhook (чужие сообщения из Telegram)
+SKIP_PREFIXES = ("/static/", "/admin/", "/webhook", "/events")
+# Параметры запроса, которые пишутся как есть; остальные (token, cursor) отбрасываются
+PLAIN_PARAMS = ("include", "metric", "week", "limit", "format")
+ID_FIELDS = ("user_id", "user_ids")
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+_lock = threading.Lock()
+# Запись в файл — из фонового потока и из flush при выходе, не одновременно
+_file_lock = threading.Lock()
+_queue = queue.SimpleQueue()
+_state = {"path": None, "key": None, "writer": None, "written": 0, "dropped": 0, "full": False}
+
+
+def anonymise(user_id, key):
+    """user_id -> стабильный псевдоним из цифр: проходит validate_user_id, но не обратим без ключа"""
+    digest = hmac.new(key.encode(), str(user_id).encode(), hashlib.sha256).hexdigest()
+    return str(int(digest[:15], 16))
+
+
+def _sampled(user_id, key):
+    if CAPTURE_SAMPLE >= 1 or user_id is None:
+        return True
+    digest = hmac.new(key.encode(), b"sample:" + str(user_id).encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:4], "big") / 2 ** 32 < CAPTURE_SAMPLE
+
+
+def shape(value, key, today, field=None):
+    """Форма тела без значений: типы полей, даты — сдвигом в днях от дня запроса.
+
+    s — строка, n — число, b — bool, null — null, "d-3" — дата за 3 дня до запроса,
+    списки — ["*", длина, форма первого элемента]. user_id обезличиваются.
+    """
+    if field in ID_FIELDS and value is not None:
+        if isinstance(value, list):
+            return {"$ids": [anonymise(item, key) for item in value]}
+        return {"$id": anonymise(value, key)}
+    if isinstance(value, dict):
+        return {name: shape(item, key, today, name) for name, item in value.items()}
+    if isinstance(value, list):
+        return ["*", len(value), shape(value[0], key, today) if value else None]
+    if isinstance(value, bool):
+        return "b"
+    if isinstance(value, (int, float)):
+        return "n"
+    if isinstance(value, str):
+        if _DATE.match(value):
+            try:
+                return f"d{(date.fromisoformat(value) - today).days:+d}"
+            except ValueError:
+                pass
+        return "s"
+    return None
+
+
+def _first_user_id(body):
+    if isinstance(body, dict):
+        if body.get("user_id") is not None:
+            return body["user_id"]
+        entries = body.get("entries")
+        body = entries if isinstance(entries, list) else None
+    if isinstance(body, list) and body and isinstance(body[0], dict):
+        return body[0].get("user_id")
+    return None
+
+
+def _writer():
+    while True:
+        records = [_queue.get()]
+        deadline = time.monotonic() + FLUSH_SECONDS
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                records.append(_queue.get(timeout=left))
+            except queue.Empty:
+                break
+        _write(records)
+
+
+def _write(records):
+    with _lock:
+        path = _state["path"]
+        if path is None or _state["full"]:
+            _state["dropped"] += len(records)
+            return
+    data = "".join(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+                   for record in records)
+    try:
+        with _file_lock, gzip.open(path, "at", encoding="utf-8") as f:
+            f.write(data)
+        size = os.path.getsize(path)
+    except OSError as e:
+        print(f"❌ Ошибка записи трафика: {e}")
+        with _lock:
+            _state["dropped"] += len(records)
+        return
+    with _lock:
+        _state["written"] += len(records)
+        if size >= CAPTURE_MAX_BYTES:
+            _state["full"] = True
+            print(f"⚠️ Файл записи трафика достиг {size // (1024 * 1024)} МБ — запись остановлена")
+
+
+def flush():
+    """Дописывает то, что ещё в очереди, — при остановке процесса"""
+    records = []
+    while True:
+        try:
+            records.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    if records:
+        _write(records)
+
+
+def start(path, key=None):
+    """Включает запись в path; без ключа — случайный (псевдонимы не совпадут со снимком)"""
+    if not key:
+        print("⚠️ CAPTURE_KEY не задан: псевдонимы пользователей действительны только до перезапуска")
+        key = secrets.token_hex(16)
+    with _lock:
+        _state.update(path=path, key=key, full=False)
+        if _state["writer"] is None:
+            _state["writer"] = threading.Thread(target=_writer, name="traffic-capture", daemon=True)
+            _state["writer"].start()
+            atexit.register(flush)
+    print(f"🎥 Запись трафика в {path}")
+
+
+def stop():
+    with _lock:
+        _state["path"] = None
+
+
+def status():
+    with _lock:
+        return {
+            "enabled": _state["path"] is not None,
+            "path": _state["path"],
+            "sample": CAPTURE_SAMPLE,
+            "written": _state["written"],
+            "dropped": _state["dropped"],
+            "full": _state["full"],
+        }
+
+
+def before_request():
+    if _state["path"] is None or request.path.startswith(SKIP_PREFIXES):
+        return
+    g.capture_started = time.perf_counter()
+    g.capture_at = time.time()
+
+
+def after_request(response):
+    started = g.get("capture_started")
+    key = _state["key"]
+    if started is None or key is None:
+        return response
+    duration_ms = (time.perf_counter() - started) * 1000
+
+    today = date.fromtimestamp(g.capture_at)
+    body = request.get_json(silent=True) if request.method == "POST" else None
+    user_id = request.args.get("user_id") or _first_user_id(body)
+    if not _sampled(user_id, key):
+        return response
+
+    params = {name: value for name, value in request.args.items() if name in PLAIN_PARAMS}
+    if request.args.get("user_id"):
+        params["user_id"] = {"$id": anonymise(request.args["user_id"], key)}
+    if request.args.get("user_ids"):
+        params["user_ids"] = {"$ids": [anonymise(part, key) for part in request.args["user_ids"].split(",") if part]}
+
+    record = {
+        "t": round(g.capture_at, 3),
+        "m": request.method,
+        "p": request.path,
+        "r": request.endpoint,
+        "s": response.status_code,
+        "ms": round(duration_ms, 2),
+        "n": None if response.is_streamed else response.calculate_content_length(),
+    }
+    if params:
+        record["q"] = params
+    if body is not None:
+        record["b"] = shape(body, key, today)
+    headers = {}
+    for name in ("Accept", "Accept-Encoding"):
+        if request.headers.get(name):
+            headers[name] = request.headers[name]
+    if request.headers.get("If-None-Match"):
+        # ETag зависит от сборки: replay подставит тот, что получил сам
+        headers["If-None-Match"] = True
+    if request.headers.get("X-Admin-Token") or request.headers.get("X-Clinician-Token") or request.args.get("token"):
+        # Сам токен не пишем: replay подставит свой
+        headers["auth"] = True
+    if headers:
+        record["h"] = headers
+    _queue.put(record)
+    return response
+
+
+if CAPTURE_PATH:
+    start(CAPTURE_PATH, CAPTURE_KEY)
@@ -0,0 +1,236 @@
+import sqlite3
+import sys
+
+# Метрика -> (таблица, колонка). Неделя считается от pregnancy_start.start_date
+METRICS = {
+    "weight": ("weights", "weight"),
+    "systolic": ("pressure_entries", "systolic"),
+    "diastolic": ("pressure_entries", "diastolic"),
+    "sugar": ("sugar_entries", "sugar"),
+    "mood": ("mood_entries", "mood"),
+    "wellbeing": ("mood_entries", "wellbeing"),
+}
+
+ROLLUP_COLUMNS = "user_id, pregnancy_week, metric, value_count, value_sum, value_min, value_max, last_value, last_date, updated_at"
+
+
+def _week_expr(date_sql):
+    return f"CAST((julianday(date({date_sql})) - julianday(ps.start_date)) / 7 AS INTEGER)"
+
+
+def _grouped_select(metric, extra_where=""):
+    """SELECT недельных агрегатов метрики из сырых данных"""
+    table, column = METRICS[metric]
+    return f"""
+        SELECT g.user_id, g.week, '{metric}', g.cnt, g.total, g.min_value, g.max_value,
+               (SELECT t2.{column} FROM {table} t2
+                WHERE t2.user_id = g.user_id AND t2.date = g.last_date AND t2.{column} IS NOT NULL
+                ORDER BY t2.rowid DESC LIMIT 1),
+               g.last_date, CURRENT_TIMESTAMP
+        FROM (
+            SELECT t.user_id AS user_id, {_week_expr("t.date")} AS week,
+                   COUNT(t.{column}) AS cnt, SUM(t.{column}) AS total,
+                   MIN(t.{column}) AS min_value, MAX(t.{column}) AS max_value,
+                   MAX(t.date) AS last_date
+            FROM {table} t
+            JOIN pregnancy_start ps ON ps.user_id = t.user_id
+            WHERE t.{column} IS NOT NULL
+              AND date(t.date) >= date(ps.start_date)
+              {extra_where}
+            GROUP BY t.user_id, week
+        ) g
+    """
+
+
+def _recompute_week_sql(metric, ref):
+    """Пересчёт одной недели пользователя для строки NEW/OLD внутри триггера.
+
+    Читается не больше недели строк по индексу (user_id, date), поэтому
+    INSERT OR REPLACE и ON CONFLICT DO UPDATE обрабатываются одинаково.
+    """
+    week = _week_expr(f"{ref}.date")
+    week_start = f"date(ps.start_date, '+' || ({week} * 7) || ' days')"
+    week_end = f"date(ps.start_date, '+' || ({week} * 7 + 7) || ' days')"
+    return f"""
+        DELETE FROM weekly_rollups
+        WHERE user_id = {ref}.user_id AND metric = '{metric}'
+          AND pregnancy_week = (
+              SELECT {week} FROM pregnancy_start ps WHERE ps.user_id = {ref}.user_id
+          );
+        INSERT INTO weekly_rollups ({ROLLUP_COLUMNS})
+        {_grouped_select(metric, f'''
+              AND t.user_id = {ref}.user_id
+              AND date({ref}.date) >= date(ps.start_date)
+              AND t.date >= {week_start}
+              AND t.date < {week_end}''')};
+    """
+
+
+def _trigger_sql():
+    tables = {}
+    for metric, (table, _) in METRICS.items():
+        tables.setdefault(table, []).append(metric)
+
+    statements = []
+    for table, metrics in tables.items():
+        events = {
+            "insert": ("INSERT", ["NEW"]),
+            "update": ("UPDATE", ["OLD", "NEW"]),
+            "delete": ("DELETE", ["OLD"]),
+        }
+        for name, (event, refs) in events.items():
+            body = "".join(_recompute_week_sql(m, ref) for ref in refs for m in metrics)
+            statements.append((
+                f"trg_rollup_{table}_{name}",
+                f"CREATE TRIGGER trg_rollup_{table}_{name} AFTER {event} ON {table} BEGIN {body} END",
+            ))
+
+    # Смена даты начала беременности сдвигает все недели пользователя
+    rebuild_body = "".join(
+        f"INSERT INTO weekly_rollups ({ROLLUP_COLUMNS}) {_grouped_select(m, 'AND t.user_id = NEW.user_id')};"
+        for m in METRICS
+    )
+    for name, event in (("insert", "INSERT"), ("update", "UPDATE")):
+        statements.append((
+            f"trg_rollup_pregnancy_start_{name}",
+            f"""CREATE TRIGGER trg_rollup_pregnancy_start_{name} AFTER {event} ON pregnancy_start BEGIN
+                DELETE FROM weekly_rollups WHERE user_id = NEW.user_id;
+                {rebuild_body}
+            END""",
+        ))
+    statements.append((
+        "trg_rollup_pregnancy_start_delete",
+        """CREATE TRIGGER trg_rollup_pregnancy_start_delete AFTER DELETE ON pregnancy_start BEGIN
+            DELETE FROM weekly_rollups WHERE user_id = OLD.user_id;
+        END""",
+    ))
+    return statements
+
+
+def init_rollup_tables(cursor):
+    """Создаёт таблицу недельных агрегатов и триггеры, которые её поддерживают"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'weekly_rollups'")
+    is_new = cursor.fetchone() is None
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS weekly_rollups (
+            user_id TEXT,
+            pregnancy_week INTEGER,
+            metric TEXT,
+            value_count INTEGER,
+            value_sum REAL,
+            value_min REAL,
+            value_max REAL,
+            last_value REAL,
+            last_date TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, metric, pregnancy_week)
+        ) WITHOUT ROWID
+    """)
+    # В старых базах у weights нет UNIQUE(user_id, date)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_weights_user_date ON weights (user_id, date)")
+
+    # Триггеры пересоздаются, чтобы изменения в их тексте применялись при деплое
+    for name, sql in _trigger_sql():
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(sql)
+
+    if is_new:
+        _fill_rollups(cursor)
+
+
+def _fill_rollups(cursor, user_id=None):
+    extra_where = "AND t.user_id = ?" if user_id else ""
+    params = (user_id,) if user_id else ()
+    for metric in METRICS:
+        cursor.execute(f"INSERT INTO weekly_rollups ({ROLLUP_COLUMNS}) {_grouped_select(metric, extra_where)}", params)
+
+
+def rebuild_rollups(conn, user_id=None):
+    """Полностью пересчитывает агрегаты из сырых данных"""
+    cursor = conn.cursor()
+    if user_id:
+        cursor.execute("DELETE FROM weekly_rollups WHERE user_id = ?", (user_id,))
+    else:
+        cursor.execute("DELETE FROM weekly_rollups")
+    _fill_rollups(cursor, user_id)
+    conn.commit()
+
+
+def check_rollups(conn, tolerance=1e-6):
+    """Сверяет weekly_rollups с агрегатами по сырым таблицам.
+
+    Возвращает список расхождений вида (user_id, week, metric, ожидалось, найдено).
+    """
+    cursor = conn.cursor()
+    expected = {}
+    for metric in METRICS:
+        cursor.execute(_grouped_select(metric))
+        for row in cursor.fetchall():
+            expected[(row[0], row[1], row[2])] = row[3:9]
+
+    actual = {}
+    cursor.execute("""
+        SELECT user_id, pregnancy_week, metric,
+               value_count, value_sum, value_min, value_max, last_value, last_date
+        FROM weekly_rollups
+    """)
+    for row in cursor.fetchall():
+        actual[(row[0], row[1], row[2])] = row[3:9]
+
+    def same(a, b):
+        if a is None or b is None:
+            return a == b
+        if a[0] != b[0] or a[5] != b[5]:
+            return False
+        return all(abs(x - y) <= tolerance for x, y in zip(a[1:5], b[1:5]) if x is not None and y is not None)
+
+    mismatches = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        if not same(expected.get(key), actual.get(key)):
+            mismatches.append((*key, expected.get(key), actual.get(key)))
+    return mismatches
+
+
+def load_weekly(cursor, user_id, metric):
+    """Недельные агрегаты метрики пользователя — поиск по первичному ключу"""
+    cursor.execute("""
+        SELECT pregnancy_week, value_count, value_sum, value_min, value_max, last_value
+        FROM weekly_rollups
+        WHERE user_id = ? AND metric = ?
+        ORDER BY pregnancy_week
+    """, (user_id, metric))
+    return [
+        {
+            "week": week,
+            "count": count,
+            "avg": round(total / count, 2) if count else None,
+            "min": value_min,
+            "max": value_max,
+            "last": last_value,
+        }
+        for week, count, total, value_min, value_max, last_value in cursor.fetchall()
+    ]
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    conn = sqlite3.connect("pregnancy.db")
+
+    if command == "check":
+        mismatches = check_rollups(conn)
+        if mismatches:
+            print(f"❌ Найдено расхождений: {len(mismatches)}")
+            for mismatch in mismatches[:50]:
+                print("  ", mismatch)
+            conn.close()
+            sys.exit(1)
+        print("✅ Недельные агрегаты совпадают с сырыми данными")
+    elif command == "rebuild":
+        user_id = sys.argv[2] if len(sys.argv) > 2 else None
+        rebuild_rollups(conn, user_id)
+        print("✅ Недельные агрегаты пересчитаны")
+    else:
+        print("Использование: python weekly_rollups.py [check | rebuild [user_id]]")
+
+    conn.close()
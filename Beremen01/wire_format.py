@@ -0,0 +1,135 @@
+import gzip
+import json
+from datetime import date
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COLUMNAR_MIMETYPE = "application/vnd.pregnancy.columnar+json"
+
+# Меньшие ответы сжимать невыгодно: заголовки и CPU дороже выигрыша
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def dumps(obj):
+    """Сериализация в JSON (bytes): orjson, если установлен, иначе stdlib"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def wants_columnar():
+    """Клиент запросил компактный формат через ?format= или Accept"""
+    fmt = request.args.get("format")
+    if fmt:
+        return fmt == "columnar"
+    return COLUMNAR_MIMETYPE in request.headers.get("Accept", "")
+
+
+def to_columnar(rows, fields):
+    """Строки [date, v1, v2, ...] -> колонки с дельтами дней.
+
+    {"start": "2024-01-01", "day_deltas": [0, 1, 3], "values": {"weight": [...]}}
+    Первая дельта — 0, каждая следующая — разница в днях с предыдущей строкой.
+    Если дата не в формате YYYY-MM-DD, возвращает None (нужен обычный формат).
+    """
+    if not rows:
+        return {"format": "columnar", "start": None, "day_deltas": [], "values": {f: [] for f in fields}}
+
+    deltas = []
+    prev = None
+    try:
+        for row in rows:
+            day = date.fromisoformat(row[0]).toordinal()
+            deltas.append(0 if prev is None else day - prev)
+            prev = day
+    except (TypeError, ValueError):
+        return None
+
+    columns = list(zip(*rows))
+    return {
+        "format": "columnar",
+        "start": rows[0][0],
+        "day_deltas": deltas,
+        "values": {field: list(columns[i + 1]) for i, field in enumerate(fields)},
+    }
+
+
+def from_columnar(block):
+    """Обратное преобразование — для тестов и бенчмарков"""
+    if block["start"] is None:
+        return []
+    day = date.fromisoformat(block["start"]).toordinal()
+    dates = []
+    for delta in block["day_deltas"]:
+        day += delta
+        dates.append(date.fromordinal(day).isoformat())
+    values = list(block["values"].values())
+    return [[d, *(column[i] for column in values)] for i, d in enumerate(dates)]
+
+
+def encode_rows(rows, fields):
+    """Строки или колонки — в зависимости от запроса клиента"""
+    if wants_columnar():
+        block = to_columnar(rows, fields)
+        if block is not None:
+            return block
+    return rows
+
+
+def pick_encoding(accept_encoding):
+    """Выбирает br или gzip по заголовку Accept-Encoding (учитывая q=0)"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    return data
+
+
+def json_response(payload, status=200):
+    """Замена jsonify для горячих эндпоинтов: быстрый JSON и сжатие"""
+    body = dumps(payload)
+    response = Response(status=status, mimetype="application/json")
+    response.vary.add("Accept")
+
+    encoding = None
+    if len(body) >= MIN_COMPRESS_BYTES:
+        encoding = pick_encoding(request.headers.get("Accept-Encoding", ""))
+    response.vary.add("Accept-Encoding")
+    if encoding:
+        body = compress(body, encoding)
+        response.headers["Content-Encoding"] = encoding
+
+    response.set_data(body)
+    return response